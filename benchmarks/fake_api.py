@@ -0,0 +1,250 @@
+"""本地模拟的网易云接口
+
+提供与 pyncm 返回格式一致的歌曲详情, 歌单, 下载地址, 歌词与用户歌单接口, 以及可断点续传的 mp3 文件.
+延迟, 错误率与限流比例均可配置. FakeApis 与 pyncm.apis 的调用方式相同, 替换 lib.apis 后
+Crawler 的请求都会发往本地服务器.
+"""
+
+import hashlib
+import http.client
+import json
+import random
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from synthetic import fake_mp3, fake_playlist, fake_png, fake_track
+
+
+@lru_cache(maxsize=4096)
+def fixture(music_id: int):
+    """每首歌的 mp3 帧数不同, 保证内容与 md5 各不相同"""
+    data = fake_mp3(1 + music_id % 37 / 10)
+    return data, hashlib.md5(data).hexdigest()
+
+
+class FakeNetease(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        playlists: dict[str, dict] | None = None,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        throttle_rate=0.0,
+        seed=0,
+        port=0,
+    ):
+        super().__init__(("127.0.0.1", port), Handler)
+        self.playlists = {int(k): v for k, v in (playlists or {}).items()}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.seed = seed
+        self.requests: Counter[str] = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-netease", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self.shutdown()
+        self.server_close()
+
+    def fault(self):
+        """按配置返回 None (正常), "error" 或 "throttle" """
+        with self._lock:
+            roll = self._rng.random()
+        if roll < self.throttle_rate:
+            return "throttle"
+        if roll < self.throttle_rate + self.error_rate:
+            return "error"
+        return None
+
+    def delay(self):
+        if self.latency or self.jitter:
+            with self._lock:
+                extra = self._rng.uniform(0, self.jitter)
+            time.sleep(self.latency + extra)
+
+    def track(self, music_id: int):
+        """封面地址指向本地服务器, 生成时无需访问外网"""
+        track = fake_track(music_id - 100_000, self.seed)
+        track["al"]["picUrl"] = f"{self.url}/artwork/{track['al']['id']}.png"
+        return track
+
+    def playlist(self, playlist_id: int):
+        playlist = self.playlists.get(playlist_id)
+        if playlist is None:
+            rng = random.Random(playlist_id)
+            ids = [100_000 + rng.randrange(100_000) for _ in range(rng.randint(10, 200))]
+            playlist = self.playlists[playlist_id] = fake_playlist(playlist_id - 9_000_000, ids, self.seed)
+        return playlist
+
+    def audio(self, music_id: int):
+        data, md5 = fixture(music_id)
+        return {
+            "id": music_id,
+            "url": f"{self.url}/file/{music_id}.mp3",
+            "br": 128000,
+            "size": len(data),
+            "md5": md5,
+            "code": 200,
+            "expi": 1200,
+            "type": "mp3",
+            "level": "standard",
+            "encodeType": "mp3",
+            "freeTrialInfo": None,
+            "fee": 0,
+        }
+
+
+class Handler(BaseHTTPRequestHandler):
+    server: FakeNetease
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *_):
+        pass
+
+    def send(self, status: int, body: bytes, content_type="application/json", headers: dict | None = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def reply(self, data: dict):
+        self.send(200, json.dumps(data, ensure_ascii=False).encode())
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        server = self.server
+        server.requests[url.path.rsplit("/", 1)[0] if url.path.count("/") > 1 else url.path] += 1
+        server.delay()
+
+        fault = server.fault()
+        if url.path.startswith("/artwork/"):
+            return self.send(200, fake_png(64), "image/png")
+        if url.path.startswith("/file/"):
+            if fault is not None:
+                return self.send(503 if fault == "error" else 429, b"")
+            return self.file(int(url.path.rsplit("/", 1)[1].split(".")[0]))
+        if fault == "throttle":
+            return self.reply({"code": -460, "message": "Cheating"})
+        if fault == "error":
+            return self.reply({"code": 500, "message": "Server error"})
+
+        ids = [int(i) for i in query.get("ids", "").split(",") if i]
+        if url.path == "/track/detail":
+            return self.reply({"code": 200, "songs": [server.track(i) for i in ids], "privileges": []})
+        if url.path == "/track/audio":
+            return self.reply({"code": 200, "data": [server.audio(i) for i in ids]})
+        if url.path == "/track/lyrics":
+            lyric = "\n".join(f"[00:{i:02d}.00]line {i}" for i in range(20))
+            return self.reply({"code": 200, "lrc": {"version": 1, "lyric": lyric}})
+        if url.path == "/playlist/detail":
+            playlist = server.playlist(int(query["id"]))
+            info = {k: v for k, v in playlist.items() if k != "music_ids"}
+            info["trackIds"] = [{"id": i, "v": 1, "t": 0} for i in playlist["music_ids"]]
+            return self.reply({"code": 200, "playlist": info})
+        if url.path == "/playlist/tracks":
+            playlist = server.playlist(int(query["id"]))
+            return self.reply({"code": 200, "songs": [server.track(i) for i in playlist["music_ids"]]})
+        if url.path == "/user/playlists":
+            offset, limit = int(query.get("offset", 0)), int(query.get("limit", 30))
+            ids = sorted(server.playlists)
+            page = [
+                {k: v for k, v in server.playlist(i).items() if k != "music_ids"} for i in ids[offset : offset + limit]
+            ]
+            return self.reply({"code": 200, "playlist": page, "more": offset + limit < len(ids)})
+        if url.path == "/user/detail":
+            return self.reply({"code": 200, "profile": {"userId": int(query["uid"]), "nickname": "benchmark"}})
+        if url.path == "/login/status":
+            return self.reply({"code": 200, "profile": {"userId": 1, "nickname": "benchmark"}})
+        self.send(404, b"{}")
+
+    def file(self, music_id: int):
+        data, _ = fixture(music_id)
+        if (value := self.headers.get("Range", "")).startswith("bytes="):
+            start = int(value[6:].split("-")[0] or 0)
+            if start >= len(data):
+                return self.send(416, b"", headers={"Content-Range": f"bytes */{len(data)}"})
+            return self.send(
+                206,
+                data[start:],
+                "audio/mpeg",
+                {"Content-Range": f"bytes {start}-{len(data) - 1}/{len(data)}", "Accept-Ranges": "bytes"},
+            )
+        self.send(200, data, "audio/mpeg", {"Accept-Ranges": "bytes"})
+
+
+class FakeApis:
+    """与 pyncm.apis 同名的接口函数, 每个线程复用一个 keep-alive 连接"""
+
+    def __init__(self, url: str):
+        self.netloc = urlsplit(url).netloc
+        self._local = threading.local()
+        self.track = SimpleNamespace(
+            GetTrackDetail=self.GetTrackDetail,
+            GetTrackAudioV1=self.GetTrackAudioV1,
+            GetTrackLyricsNew=self.GetTrackLyricsNew,
+        )
+        self.playlist = SimpleNamespace(
+            GetPlaylistInfo=self.GetPlaylistInfo, GetPlaylistAllTracks=self.GetPlaylistAllTracks
+        )
+        self.user = SimpleNamespace(GetUserPlaylists=self.GetUserPlaylists, GetUserDetail=self.GetUserDetail)
+        self.login = SimpleNamespace(GetCurrentLoginStatus=self.GetCurrentLoginStatus)
+
+    def get(self, path: str, **query) -> dict:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.netloc, timeout=30)
+        try:
+            conn.request("GET", f"{path}?{urlencode(query)}")
+            return json.loads(conn.getresponse().read())
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            raise
+
+    def GetTrackDetail(self, song_ids: list[int], session=None):
+        return self.get("/track/detail", ids=",".join(map(str, song_ids)))
+
+    def GetTrackAudioV1(self, song_ids: list[int], level="standard", encodeType="flac", session=None):
+        return self.get("/track/audio", ids=",".join(map(str, song_ids)), level=level)
+
+    def GetTrackLyricsNew(self, song_id: int, session=None):
+        return self.get("/track/lyrics", id=song_id)
+
+    def GetPlaylistInfo(self, playlist_id: int, offset=0, total=True, limit=1000, session=None):
+        return self.get("/playlist/detail", id=playlist_id)
+
+    def GetPlaylistAllTracks(self, playlist_id: int, offset=0, limit=1000, session=None):
+        return self.get("/playlist/tracks", id=playlist_id)
+
+    def GetUserPlaylists(self, user_id: int, offset=0, limit=1001, session=None):
+        return self.get("/user/playlists", uid=user_id, offset=offset, limit=limit)
+
+    def GetUserDetail(self, user_id: int, session=None):
+        return self.get("/user/detail", uid=user_id)
+
+    def GetCurrentLoginStatus(self, session=None):
+        return self.get("/login/status")
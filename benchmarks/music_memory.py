@@ -0,0 +1,55 @@
+"""歌曲记录内存占用与加载耗时基准
+
+uv run python benchmarks/music_memory.py --count 50000
+"""
+
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from synthetic import fake_track  # noqa: E402
+
+
+def measure(label: str, build, *args):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build(*args)
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<24} {current / 2**20:8.1f} MiB  {elapsed:6.2f} s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=50000)
+    args = parser.parse_args()
+
+    os.environ["NETEASECRAWLER_HOME"] = tempfile.mkdtemp(prefix="neteasecrawler-bench-")
+    from project import lib
+
+    payloads = [fake_track(i) for i in range(args.count)]
+    musics = measure("from api payloads", lambda items: {str(p["id"]): lib.Music(**p) for p in items}, payloads)
+    del payloads
+
+    db = lib.DB(Path(os.environ["NETEASECRAWLER_HOME"]) / "bench.db")
+    db.musics.update(musics)
+    db.save()
+    del musics, db
+
+    db = lib.DB(Path(os.environ["NETEASECRAWLER_HOME"]) / "bench.db")
+    loaded = measure("load from database", lambda table: dict(table.items()), db.musics)
+    measure("std names", lambda items: [m.get_std_name() for m in items], loaded.values())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""命令行启动耗时基准
+
+对每个只读子命令启动若干次 `neteasecrawler`, 统计耗时中位数, 并检查启动时没有加载重量级依赖.
+
+    uv run python benchmarks/startup.py --runs 10 --max-ms 300
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+COMMANDS = [
+    ["--help"],
+    ["user", "list"],
+    ["music", "list"],
+    ["music", "find", "--name", "benchmark", "--fuzzy"],
+    ["playlist", "list"],
+    ["playlist", "find", "--name", "benchmark", "--fuzzy"],
+    ["build", "list"],
+]
+
+HEAVY_MODULES = ["DrissionPage", "pyncm", "music_tag", "httpx", "paramiko"]
+
+RUNNER = """
+import sys
+sys.argv = ["neteasecrawler", *{args!r}]
+from project.scripts import neteasecrawler
+try:
+    neteasecrawler()
+except SystemExit:
+    pass
+loaded = [m for m in {heavy!r} if m in sys.modules]
+if loaded:
+    print("HEAVY:" + ",".join(loaded), file=sys.stderr)
+"""
+
+
+def run(args: list[str], env: dict[str, str]):
+    code = RUNNER.format(args=args, heavy=HEAVY_MODULES)
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True)
+    elapsed = (time.perf_counter() - start) * 1000
+    heavy = [line[6:] for line in proc.stderr.splitlines() if line.startswith("HEAVY:")]
+    return elapsed, heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, default=0, help="任一子命令中位数超过该值时返回非零")
+    parser.add_argument("--home", help="数据目录, 默认使用临时目录")
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env["NETEASECRAWLER_HOME"] = args.home or tempfile.mkdtemp(prefix="neteasecrawler-bench-")
+
+    results = {}
+    failed = False
+    for command in COMMANDS:
+        timings = []
+        heavy: list[str] = []
+        for _ in range(args.runs):
+            elapsed, heavy = run(command, env)
+            timings.append(elapsed)
+        name = " ".join(command)
+        median = statistics.median(timings)
+        results[name] = {"median_ms": median, "min_ms": min(timings), "heavy_modules": heavy}
+        note = f"  heavy: {', '.join(heavy)}" if heavy else ""
+        print(f"{name:<45} {median:8.1f} ms  (min {min(timings):.1f} ms){note}")
+        if heavy or (args.max_ms and median > args.max_ms):
+            failed = True
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
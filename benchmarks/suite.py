@@ -0,0 +1,274 @@
+"""离线基准套件
+
+在临时数据目录中生成合成曲库, 启动本地模拟接口 (fake_api.py), 依次测量数据库迁移/加载/保存,
+本地搜索, 拉取歌单, 下载与生成的耗时. 结果写入 benchmarks/results/<版本>-<规模>.json,
+并与同一规模下最近一次其他版本的结果比较.
+
+    uv run python benchmarks/suite.py --scale 10k
+    uv run python benchmarks/suite.py --scale 1k --only pull,download --latency 0.02 --error-rate 0.05
+"""
+
+import argparse
+import datetime as dt
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from fake_api import FakeApis, FakeNetease  # noqa: E402
+from synthetic import SCALES, write_library  # noqa: E402
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+BENCHMARKS: dict[str, Callable[["Context"], dict[str, float]]] = {}
+
+
+def benchmark(name: str):
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return decorator
+
+
+class Context:
+    def __init__(self, args: argparse.Namespace, home: Path):
+        os.environ["NETEASECRAWLER_HOME"] = str(home)
+        from project import lib
+
+        self.args = args
+        self.home = home
+        self.lib = lib
+        self.tracks, self.playlists = write_library(home / "library", SCALES[args.scale], seed=args.seed)
+        self.server = FakeNetease(
+            self.playlists,
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            throttle_rate=args.throttle_rate,
+            seed=args.seed,
+        )
+
+    def reset(self, library=False):
+        """清空数据目录; library 时从合成的 JSON 重新迁移出数据库"""
+        lib = self.lib
+        if "conn" in vars(lib.db):
+            lib.db.conn.close()
+        for child in lib.BASE_DIR.iterdir():
+            if child.name != "library":
+                shutil.rmtree(child) if child.is_dir() else child.unlink()
+        if library:
+            for name in ("musics.json", "playlists.json"):
+                shutil.copyfile(self.home / "library" / name, lib.BASE_DIR / name)
+        lib.db = lib.DB(lib.DB_FILE)
+        lib.audio_urls.clear()
+        lib.get_artwork_cache.cache_clear()
+        rate = self.args.api_rate
+        lib.limiter = lib.RateLimiter({kind: rate for kind in lib.limiter.rates}, default_rate=rate)
+        lib.apis = FakeApis(self.server.url)
+
+    def playlist_ids(self):
+        return [int(i) for i in list(self.playlists)[: self.args.playlists]]
+
+    def music_ids(self):
+        ids = dict.fromkeys(i for p in self.playlist_ids() for i in self.playlists[str(p)]["music_ids"])
+        return list(ids)[: self.args.downloads]
+
+
+def timed(func: Callable, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+@benchmark("db")
+def bench_db(ctx: Context):
+    lib = ctx.lib
+    ctx.reset(library=True)
+    results = {"db.migrate": timed(lambda: lib.db.conn)}
+    lib.db.conn.close()
+    lib.db = lib.DB(lib.DB_FILE)
+    start = time.perf_counter()
+    musics = dict(lib.db.musics.items())
+    playlists = dict(lib.db.playlists.items())
+    results["db.load"] = time.perf_counter() - start
+    lib.db.musics.update(musics)
+    lib.db.playlists.update(playlists)
+    results["db.save"] = timed(lib.db.save)
+    return results
+
+
+@benchmark("search")
+def bench_search(ctx: Context):
+    lib = ctx.lib
+    ctx.reset(library=True)
+    tracks = list(ctx.tracks.values())[:: max(1, len(ctx.tracks) // 100)]
+    results = {"search.first": timed(lambda: list(lib.find_music(name=tracks[0]["name"], fuzzy=True)))}
+    results["search.id"] = statistics.median(timed(lambda t=t: list(lib.find_music(id=t["id"]))) for t in tracks)
+    results["search.exact"] = statistics.median(timed(lambda t=t: list(lib.find_music(name=t["name"]))) for t in tracks)
+    results["search.fuzzy"] = statistics.median(
+        timed(lambda t=t: list(lib.find_music(name=t["name"][:4], fuzzy=True))) for t in tracks
+    )
+    results["search.in_playlists"] = statistics.median(
+        timed(lambda t=t: list(lib.find_music_in_playlists(id=t["id"]))) for t in tracks
+    )
+    return results
+
+
+@benchmark("pull")
+def bench_pull(ctx: Context):
+    lib = ctx.lib
+    ctx.reset()
+    crawler = lib.Crawler()
+
+    def pull(**kwargs):
+        """与 pull_all_playlist 一样, 单个歌单失败不影响其他歌单"""
+        for playlist_id in ctx.playlist_ids():
+            try:
+                crawler.pull_playlist(playlist_id, **kwargs)
+            except Exception as e:
+                print(f"Failed to pull {playlist_id}: {e!r}", file=sys.stderr)
+
+    results = {"pull.cold": timed(pull)}
+    results["pull.incremental"] = timed(pull, incremental=True)
+    results["pull.save"] = timed(lib.db.save)
+
+    from project import engine
+
+    ctx.reset()
+    results["pull.concurrent"] = timed(engine.run, "pull_playlists", ctx.playlist_ids())
+    return results
+
+
+@benchmark("download")
+def bench_download(ctx: Context):
+    lib = ctx.lib
+    ctx.reset()
+    crawler = lib.Crawler()
+    music_ids = ctx.music_ids()
+    crawler.get_details_batch(music_ids)
+    results = {"download.cold": timed(crawler.download_musics, music_ids)}
+    results["download.up_to_date"] = timed(crawler.download_musics, music_ids)
+    crawler.downloader.close()
+    return results
+
+
+@benchmark("build")
+def bench_build(ctx: Context):
+    lib = ctx.lib
+    ctx.reset()
+    crawler = lib.Crawler()
+    music_ids = ctx.music_ids()
+    musics, _ = crawler.get_details_batch(music_ids)
+    crawler.download_musics(music_ids)
+    crawler.downloader.close()
+    musics = [m for m in musics.values() if m.get_download_path().exists()]
+    results = {"build.cold": timed(lib.build_musics, musics, "benchmark")}
+    results["build.warm"] = timed(lib.build_musics, musics, "benchmark")
+    results["build.stream"] = timed(crawler.stream_musics, musics, "stream")
+    return results
+
+
+def version():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        from importlib.metadata import version
+
+        return version("neteasecrawler")
+
+
+def previous(scale: str, current: Path):
+    """同一规模下最近一次其他版本的结果"""
+    files = [fp for fp in RESULTS_DIR.glob(f"*-{scale}.json") if fp != current]
+    return json.loads(max(files, key=lambda fp: fp.stat().st_mtime).read_text()) if files else None
+
+
+def compare(results: dict[str, float], baseline: dict | None, threshold: float):
+    regressions = []
+    for name, value in results.items():
+        base = (baseline or {}).get("results", {}).get(name)
+        if not base:
+            print(f"{name:<24} {value * 1000:10.1f} ms")
+            continue
+        ratio = value / base
+        mark = "  REGRESSION" if ratio > threshold else ""
+        print(f"{name:<24} {value * 1000:10.1f} ms  {ratio:5.2f}x vs {baseline['version']}{mark}")
+        if mark:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=list(SCALES), default="1k")
+    parser.add_argument("--only", help=f"逗号分隔的基准名称: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数, 取中位数")
+    parser.add_argument("--playlists", type=int, default=10, help="pull 基准拉取的歌单数")
+    parser.add_argument("--downloads", type=int, default=200, help="download/build 基准处理的歌曲数")
+    parser.add_argument("--latency", type=float, default=0.0, help="模拟接口的固定延迟 (秒)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="在固定延迟上附加的随机延迟上限 (秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--api-rate", type=float, default=1000.0, help="限流器初始速率 (次/秒)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threshold", type=float, default=1.2, help="超过基线该倍数视为退化")
+    parser.add_argument("--no-save", action="store_true", help="不写入结果文件")
+    args = parser.parse_args()
+
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    home = Path(tempfile.mkdtemp(prefix="neteasecrawler-bench-"))
+    ctx = Context(args, home)
+    runs: dict[str, list[float]] = {}
+    skipped = {}
+    try:
+        with ctx.server:
+            for name in names:
+                for _ in range(args.repeat):
+                    try:
+                        for key, value in BENCHMARKS[name](ctx).items():
+                            runs.setdefault(key, []).append(value)
+                    except ImportError as e:
+                        skipped[name] = str(e)
+                        print(f"Skipped {name}: {e}", file=sys.stderr)
+                        break
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+    results = {key: statistics.median(values) for key, values in runs.items()}
+    current = RESULTS_DIR / f"{version()}-{args.scale}.json"
+    regressions = compare(results, previous(args.scale, current), args.threshold)
+    record = {
+        "version": version(),
+        "date": dt.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("only", "no_save", "threshold")},
+        "results": results,
+        "skipped": skipped,
+        "requests": dict(ctx.server.requests),
+    }
+    if not args.no_save:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        current.write_text(json.dumps(record, indent=4))
+        print(f"Saved: {current.relative_to(Path.cwd()) if current.is_relative_to(Path.cwd()) else current}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""合成测试数据: 结构与接口返回的歌曲详情一致"""
+
+import json
+import random
+import struct
+import zlib
+from pathlib import Path
+
+WORDS = ["夜", "风", "星", "海", "光", "梦", "雨", "城", "love", "night", "blue", "summer", "dream", "heart", "road"]
+
+
+def fake_name(rng: random.Random, words=3):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, words)))
+
+
+def fake_quality(rng: random.Random, br: int):
+    size = rng.randint(2_000_000, 12_000_000)
+    return {"br": br, "fid": 0, "size": size, "vd": -rng.randint(1000, 60000), "sr": 44100}
+
+
+def fake_track(i: int, seed=0):
+    """生成一条与 GetTrackDetail 返回格式一致的歌曲详情"""
+    rng = random.Random(seed * 1_000_003 + i)
+    artists = [
+        {"id": rng.randint(1, 10**7), "name": fake_name(rng, 2), "tns": [], "alias": []}
+        for _ in range(rng.randint(1, 3))
+    ]
+    album_id = rng.randint(1, 10**8)
+    return {
+        "name": fake_name(rng),
+        "id": 100_000 + i,
+        "pst": 0,
+        "t": 0,
+        "ar": artists,
+        "alia": [],
+        "pop": 100.0,
+        "st": 0,
+        "rt": "",
+        "fee": rng.choice([0, 1, 8]),
+        "v": rng.randint(1, 100),
+        "crbt": None,
+        "cf": "",
+        "al": {
+            "id": album_id,
+            "name": fake_name(rng),
+            "picUrl": f"https://p1.music.126.net/{album_id:x}/{album_id}.jpg",
+            "tns": [],
+            "pic_str": str(album_id),
+            "pic": album_id,
+        },
+        "dt": rng.randint(60_000, 400_000),
+        "h": fake_quality(rng, 320000),
+        "m": fake_quality(rng, 192000),
+        "l": fake_quality(rng, 128000),
+        "sq": fake_quality(rng, 999000),
+        "hr": None,
+        "a": None,
+        "cd": "01",
+        "no": rng.randint(1, 20),
+        "rtUrl": None,
+        "ftype": 0,
+        "rtUrls": [],
+        "djId": 0,
+        "copyright": 1,
+        "s_id": 0,
+        "mark": 8192,
+        "originCoverType": 0,
+        "originSongSimpleData": None,
+        "tagPicList": None,
+        "resourceState": True,
+        "version": rng.randint(1, 50),
+        "songJumpInfo": None,
+        "entertainmentTags": None,
+        "displayTags": None,
+        "awardTags": None,
+        "single": 0,
+        "noCopyrightRcmd": None,
+        "mv": 0,
+        "rtype": 0,
+        "rurl": None,
+        "mst": 9,
+        "cp": rng.randint(1, 10**6),
+        "publishTime": rng.randint(946684800000, 1735689600000),
+        "tns": [],
+    }
+
+
+SCALES = {"1k": 1_000, "10k": 10_000, "100k": 100_000}
+
+MP3_FRAME_HEADER = bytes.fromhex("fffb9064")
+"""MPEG-1 Layer III, 128 kbps, 44.1 kHz, 无填充, 每帧 144 * 128000 / 44100 = 417 字节"""
+MP3_FRAME_SIZE = 417
+MP3_FRAMES_PER_SECOND = 44100 / 1152
+
+
+def fake_mp3(seconds=1.0):
+    """生成可被 mutagen 识别的静音 mp3, 一秒约 16 KiB"""
+    frame = MP3_FRAME_HEADER + bytes(MP3_FRAME_SIZE - len(MP3_FRAME_HEADER))
+    return frame * max(1, round(seconds * MP3_FRAMES_PER_SECOND))
+
+
+def fake_png(size=1):
+    """生成 size x size 的灰色 png, 用作专辑封面"""
+
+    def chunk(kind: bytes, data: bytes):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    rows = b"".join(b"\x00" + b"\x80" * size for _ in range(size))
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 0, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(rows))
+        + chunk(b"IEND", b"")
+    )
+
+
+def fake_playlist(i: int, music_ids: list[int], seed=0):
+    """生成一条与 Playlist 字段一致的歌单"""
+    rng = random.Random(seed * 1_000_003 + 10**9 + i)
+    created = rng.randint(946684800000, 1735689600000)
+    return {
+        "id": 9_000_000 + i,
+        "name": fake_name(rng, 4),
+        "description": fake_name(rng, 8),
+        "createTime": created,
+        "updateTime": created,
+        "trackCount": len(music_ids),
+        "trackUpdateTime": created,
+        "music_ids": music_ids,
+    }
+
+
+def fake_library(musics: int, playlists: int | None = None, seed=0):
+    """生成 musics 首歌曲与若干歌单, 每首歌平均属于两个歌单"""
+    rng = random.Random(seed)
+    tracks = {str(100_000 + i): fake_track(i, seed) for i in range(musics)}
+    ids = [100_000 + i for i in range(musics)]
+    playlists = playlists or max(1, musics // 500)
+    size = max(1, 2 * musics // playlists)
+    lists = {}
+    for i in range(playlists):
+        playlist = fake_playlist(i, rng.sample(ids, min(size, musics)), seed)
+        lists[str(playlist["id"])] = playlist
+    return tracks, lists
+
+
+def write_library(root: Path, musics: int, playlists: int | None = None, seed=0):
+    """写出旧版 musics.json 与 playlists.json, 首次打开数据库时会自动迁移"""
+    tracks, lists = fake_library(musics, playlists, seed)
+    root.mkdir(parents=True, exist_ok=True)
+    (root / "musics.json").write_text(json.dumps(tracks, ensure_ascii=False))
+    (root / "playlists.json").write_text(json.dumps(lists, ensure_ascii=False))
+    return tracks, lists
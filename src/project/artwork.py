@@ -0,0 +1,108 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from .downloader import HEADERS
+from .metrics import metrics
+
+
+class ArtworkCache:
+    """专辑封面缓存: 按 picUrl 索引, 按内容哈希存储, 带进程内 LRU 与磁盘容量上限"""
+
+    def __init__(self, root: Path, max_bytes=512 * 1024 * 1024, memory_items=64, size: int | None = None):
+        self.root = root
+        self.objects_dir = root / "objects"
+        self.urls_dir = root / "urls"
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.size = size
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+        self._url_locks: dict[str, threading.Lock] = {}
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import httpx
+
+            self._client = httpx.Client(headers=HEADERS, timeout=30.0, follow_redirects=True)
+        return self._client
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+
+    def _url(self, url: str):
+        """网易云图床支持通过 param 参数在服务端缩放封面"""
+        return f"{url}?param={self.size}y{self.size}" if self.size else url
+
+    def _remember(self, key: str, data: bytes):
+        with self._lock:
+            self._memory[key] = data
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _read(self, key: str):
+        ref = self.urls_dir / key
+        if not ref.exists():
+            return None
+        obj = self.objects_dir / ref.read_text()
+        try:
+            data = obj.read_bytes()
+        except FileNotFoundError:
+            return None
+        os.utime(obj)
+        return data
+
+    def _write(self, key: str, data: bytes):
+        digest = hashlib.sha256(data).hexdigest()
+        obj = self.objects_dir / digest
+        if not obj.exists():
+            self.objects_dir.mkdir(parents=True, exist_ok=True)
+            tmp = obj.with_name(f"{digest}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, obj)
+        self.urls_dir.mkdir(parents=True, exist_ok=True)
+        (self.urls_dir / key).write_text(digest)
+
+    def get(self, url: str):
+        """获取封面数据, 依次查询内存, 磁盘与网络"""
+        key = hashlib.sha1(self._url(url).encode()).hexdigest()
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                metrics.count("cache.artwork.memory")
+                return self._memory[key]
+            url_lock = self._url_locks.setdefault(key, threading.Lock())
+
+        with url_lock:
+            data = self._read(key)
+            if data is None:
+                with metrics.timer("artwork.fetch"):
+                    response = self.client.get(self._url(url))
+                    response.raise_for_status()
+                data = response.content
+                self._write(key, data)
+                metrics.count("cache.artwork.miss")
+            else:
+                metrics.count("cache.artwork.disk")
+        self._remember(key, data)
+        return data
+
+    def evict(self):
+        """磁盘占用超过上限时删除最久未使用的封面"""
+        if not self.objects_dir.exists():
+            return
+        objects = [(fp, fp.stat()) for fp in self.objects_dir.iterdir() if not fp.name.endswith(".tmp")]
+        total = sum(stat.st_size for _, stat in objects)
+        if total <= self.max_bytes:
+            return
+        for fp, stat in sorted(objects, key=lambda x: x[1].st_mtime):
+            fp.unlink(missing_ok=True)
+            total -= stat.st_size
+            if total <= self.max_bytes:
+                break
@@ -1,6 +1,12 @@
+import hashlib
+import json
 import os
+import queue
+import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
 
-import paramiko
+from .metrics import metrics
 
 
 def get_current_user():
@@ -11,8 +17,115 @@ def get_current_user():
 
 
 def connect_azura_sftp(host: str, port: int, username: str, password: str | None):
+    import paramiko
+
     ssh = paramiko.SSHClient()
     ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
     ssh.connect(host, port=port, username=username, password=password)
     sftp = ssh.open_sftp()
     return sftp
+
+
+def file_hash(fp: Path):
+    with fp.open("rb") as f:
+        return hashlib.file_digest(f, "sha1").hexdigest()
+
+
+class SyncManifest:
+    """记录上次推送到服务器的文件内容哈希, 本地未变化的文件无需任何远程请求即可跳过"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries: dict[str, dict] = json.loads(path.read_text()) if path.exists() else {}
+
+    def local_hash(self, name: str, fp: Path):
+        """本地文件 mtime/size 未变时复用已记录的哈希"""
+        stat = fp.stat()
+        entry = self.entries.get(name)
+        if entry is not None and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            return entry["hash"]
+        return file_hash(fp)
+
+    def record(self, name: str, fp: Path, digest: str):
+        stat = fp.stat()
+        self.entries[name] = {"hash": digest, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(self.entries, ensure_ascii=False))
+        os.replace(tmp, self.path)
+
+
+def put_pipelined(sftp, fp: Path, remote_path: str, chunk_size=1024 * 1024):
+    """流水线写入: 不等待每个写请求的确认即继续发送"""
+    with metrics.timer("sftp.put", path=remote_path), fp.open("rb") as local, sftp.open(remote_path, "wb") as remote:
+        remote.set_pipelined(True)
+        while chunk := local.read(chunk_size):
+            remote.write(chunk)
+            metrics.count("sftp.bytes", len(chunk))
+
+
+def sync_files(
+    sftp, files: dict[str, Path], manifest: SyncManifest, channels=4, remove=True, expected: set[str] | None = None
+):
+    """将本地文件同步到 sftp 当前目录, 多个 SFTP 通道并行上传
+
+    remove 时删除远端不在 expected (默认为 files) 中的文件; 本地暂缺的文件列入 expected 即可保留远端的旧版本.
+    """
+    import paramiko
+
+    remote = {attr.filename: attr for attr in sftp.listdir_attr()}
+    uploads: list[tuple[str, Path, str]] = []
+    for name, fp in files.items():
+        digest = manifest.local_hash(name, fp)
+        entry = manifest.entries.get(name)
+        attr = remote.get(name)
+        if attr is not None and entry is not None and entry["hash"] == digest and attr.st_size == entry["size"]:
+            continue
+        uploads.append((name, fp, digest))
+    print(f"Uploading: {len(uploads)}, up to date: {len(files) - len(uploads)}.")
+
+    cwd = sftp.getcwd() or "."
+    transport = sftp.get_channel().get_transport()
+    clients = [sftp]
+    for _ in range(min(channels, len(uploads)) - 1):
+        client = paramiko.SFTPClient.from_transport(transport)
+        client.chdir(cwd)
+        clients.append(client)
+    idle: queue.Queue = queue.Queue()
+    for client in clients:
+        idle.put(client)
+
+    def upload(name: str, fp: Path, digest: str):
+        client = idle.get()
+        try:
+            put_pipelined(client, fp, name)
+        except Exception as e:
+            return name, fp, e
+        finally:
+            idle.put(client)
+        return name, fp, digest
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+            futures = [executor.submit(upload, *item) for item in uploads]
+            for future in as_completed(futures):
+                name, fp, digest = future.result()
+                if isinstance(digest, Exception):
+                    warnings.warn(f"Failed to upload {name}: {digest}")
+                    manifest.entries.pop(name, None)
+                    continue
+                manifest.record(name, fp, digest)
+                print(f"Uploaded: {name}")
+    finally:
+        for client in clients[1:]:
+            client.close()
+        keep = set(files) if expected is None else expected | set(files)
+        if remove:
+            for name in set(remote).difference(keep):
+                print(f"Removing: {name} ...")
+                sftp.remove(name)
+                manifest.entries.pop(name, None)
+        manifest.entries = {k: v for k, v in manifest.entries.items() if k in keep}
+        manifest.save()
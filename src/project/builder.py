@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+FICLONE = 0x40049409
+
+
+def clone_file(src: Path, dst: Path):
+    """复制文件, 文件系统支持时使用 reflink (写时复制) 以避免实际拷贝数据"""
+    tmp = dst.with_name(dst.name + ".tmp")
+    try:
+        import fcntl
+
+        with src.open("rb") as fsrc, tmp.open("wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except (ImportError, OSError):
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+def link_file(src: Path, dst: Path):
+    """将 dst 硬链接到 src, 文件系统不支持时退回 clone_file"""
+    tmp = dst.with_name(dst.name + ".tmp")
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        clone_file(src, dst)
+        return
+    os.replace(tmp, dst)
+
+
+def fingerprint(fp: Path):
+    try:
+        stat = fp.stat()
+    except FileNotFoundError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def tags_hash(*values):
+    return hashlib.sha1(json.dumps(values, ensure_ascii=False).encode()).hexdigest()
+
+
+class BuildManifest:
+    """记录每个生成文件对应的源文件指纹与标签哈希, 未变化的文件无需重新打开"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries: dict[str, dict] = json.loads(path.read_text()) if path.exists() else {}
+
+    def is_fresh(self, key: str, source: Path, dist: Path, tags: str):
+        entry = self.entries.get(key)
+        return (
+            entry is not None
+            and entry["tags"] == tags
+            and entry["source"] == fingerprint(source)
+            and entry["dist"] == fingerprint(dist)
+        )
+
+    def record(self, key: str, source: Path, dist: Path, tags: str):
+        self.entries[key] = {"source": fingerprint(source), "dist": fingerprint(dist), "tags": tags}
+
+    def save(self, keys=None):
+        if keys is not None:
+            self.entries = {k: v for k, v in self.entries.items() if k in keys}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(self.entries, ensure_ascii=False))
+        os.replace(tmp, self.path)
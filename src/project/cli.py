@@ -1,10 +1,23 @@
+import os
+import sys
+from functools import cache
 from getpass import getpass
+from pathlib import Path
 
 import click
 
-from . import lib
+from . import engine, lib
+from . import worker as workers
 from .azuracast import *
+from .daemon import AzuraTarget, Daemon, Scheduler
 from .lib import *
+from .metrics import metrics
+
+
+@cache
+def get_crawler():
+    """同一条命令内共享一个已登录的 Crawler"""
+    return Crawler.open()
 
 
 def try_index(lst: list, value):
@@ -14,10 +27,114 @@ def try_index(lst: list, value):
         return -1
 
 
+def parse_rate(value: str):
+    """解析带宽, 如 "512K", "2M" (字节/秒)"""
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    value = value.strip().upper().removesuffix("B").removesuffix("/S")
+    try:
+        if value[-1:] in units:
+            return float(value[:-1]) * units[value[-1]]
+        return float(value)
+    except ValueError:
+        raise click.BadParameter(f"invalid rate: {value!r}") from None
+
+
+def parse_hours(value: str):
+    try:
+        start, end = (int(i) for i in value.split("-"))
+    except ValueError:
+        raise click.BadParameter(f"expected START-END hours, got {value!r}") from None
+    if not (0 <= start < 24 and 0 <= end <= 24):
+        raise click.BadParameter(f"hours out of range: {value!r}")
+    return start, end
+
+
 @click.group()
-@click.option("--api-delay", help="API delay", default=0.0, type=float)
-def cli(api_delay: float):
-    lib.api_deplay = api_delay
+@click.option("--api-delay", help="Fixed delay between API calls (default: adaptive).", default=0.0, type=float)
+@click.option("--batch-size", help="Number of musics per detail request.", default=500, type=int)
+@click.option("--workers", help="Number of concurrent downloads.", default=8, type=int)
+@click.option("--api-concurrency", help="Maximum API requests in flight per endpoint.", default=16, type=int)
+@click.option("--build-workers", help="Number of files tagged in parallel.", default=lib.build_workers, type=int)
+@click.option("--artwork-size", help="Resize embedded album covers to this many pixels.", type=int)
+@click.option("--artwork-cache-size", help="Album cover cache limit in MiB.", default=512, type=int)
+@click.option("--lyrics-ttl", help="Days before cached lyrics are fetched again (0: never).", default=30.0, type=float)
+@click.option(
+    "--quality",
+    help="Default download quality (lossless and hires are saved as FLAC).",
+    type=click.Choice(QUALITY_LEVELS),
+    default="standard",
+)
+@click.option("--max-bandwidth", help="Total download rate limit, e.g. 2M (bytes/s).")
+@click.option("--host-bandwidth", help="Per-host rate limit, e.g. music.126.net=1M (repeatable).", multiple=True)
+@click.option("--bandwidth-hours", help="Only limit download rate between these local hours, e.g. 9-18.")
+@click.option("--profile", help="Print per-stage timings and counters when the command finishes.", is_flag=True)
+@click.option(
+    "--trace",
+    help="Write timing events to FILE (.ndjson: one per line, otherwise Chrome trace JSON).",
+    type=click.Path(dir_okay=False, path_type=Path),
+)
+@click.option(
+    "--cprofile", help="Dump cProfile stats of the command to FILE.", type=click.Path(dir_okay=False, path_type=Path)
+)
+@click.pass_context
+def cli(
+    ctx: click.Context,
+    api_delay: float,
+    batch_size: int,
+    workers: int,
+    api_concurrency: int,
+    build_workers: int,
+    artwork_size: int | None,
+    artwork_cache_size: int,
+    lyrics_ttl: float,
+    quality: str,
+    max_bandwidth: str | None,
+    host_bandwidth: tuple[str, ...],
+    bandwidth_hours: str | None,
+    profile: bool,
+    trace: Path | None,
+    cprofile: Path | None,
+):
+    if api_delay > 0:
+        lib.limiter.set_interval(api_delay)
+    lib.detail_batch_size = batch_size
+    lib.download_workers = workers
+    lib.api_concurrency = api_concurrency
+    lib.build_workers = build_workers
+    lib.artwork_size = artwork_size
+    lib.artwork_cache_size = artwork_cache_size * 1024 * 1024
+    lib.lyrics_ttl = lyrics_ttl * 24 * 3600 or None
+    lib.quality = quality
+    host_rates = {}
+    for rule in host_bandwidth:
+        host, sep, rate = rule.partition("=")
+        if not sep:
+            raise click.BadParameter(f"expected HOST=RATE, got {rule!r}", param_hint="--host-bandwidth")
+        host_rates[host] = parse_rate(rate)
+    lib.bandwidth = Bandwidth(
+        parse_rate(max_bandwidth) if max_bandwidth else None,
+        host_rates,
+        parse_hours(bandwidth_hours) if bandwidth_hours else None,
+    )
+    if profile or trace:
+        metrics.enable(trace)
+        ctx.call_on_close(lambda: report_metrics(profile))
+    if cprofile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        @ctx.call_on_close
+        def dump_profile():
+            profiler.disable()
+            profiler.dump_stats(cprofile)
+
+
+def report_metrics(summary: bool):
+    metrics.close()
+    if summary:
+        print(metrics.summary(), file=sys.stderr)
 
 
 def music():
@@ -40,10 +157,12 @@ def music():
         """Search musics by id or name."""
         if id is None and name is None:
             raise click.UsageError("id or name must be specified")
+        music_ids = []
         for music_id, music_name in find_music(id=id, name=name, fuzzy=fuzzy):
             print(f"{music_id} - {music_name}")
-            if download:
-                Crawler.open().download_music(music_id)
+            music_ids.append(music_id)
+        if download and music_ids:
+            get_crawler().download_musics(music_ids)
 
     @music.command()
     @click.option("--id", help="Music id to search in playlist.", type=int)
@@ -57,6 +176,37 @@ def music():
             print(f"music: {m_id} - {m_name}")
             print(f"  playlist: {p_id} - {p_name}")
 
+    @music.command()
+    @click.option("--workers", help="Number of files hashed in parallel.", type=int)
+    @click.option("--redownload", help="Queue corrupt and trial files for redownload.", is_flag=True)
+    def verify(workers: int | None, redownload: bool):
+        """Check downloaded musics against the size and md5 reported by the API."""
+        verify_library(workers, redownload=redownload)
+
+    @music.command()
+    @click.option("--playlist-id", help="Only upgrade musics of this playlist (repeatable).", type=int, multiple=True)
+    @click.option("--limit", help="Upgrade at most this many musics.", type=int)
+    def upgrade(playlist_id: tuple[int, ...], limit: int | None):
+        """Download musics again whose quality is below the one their playlists ask for.
+
+        Built files pick up the new download on the next build.
+        """
+        music_ids = pending_upgrades(list(playlist_id) or None)[:limit]
+        if not music_ids:
+            print("Nothing to upgrade.")
+            return
+        get_crawler().download_musics(music_ids, requeue=False)
+
+    @music.command()
+    def redownload():
+        """Download the musics queued by failed downloads or `music verify --redownload`."""
+        job = db.jobs.unfinished("redownload")
+        if job is None:
+            print("Nothing to redownload.")
+            return
+        db.jobs.retry_failed(job)
+        get_crawler().run_job(job)
+
 
 def playlist():
     @cli.group()
@@ -86,15 +236,66 @@ def playlist():
     @click.option("--id", help="Playlist id to pull.", type=int)
     @click.option("--name", help="Playlist name to pull.")
     @click.option("--fuzzy", help="Fuzzy search.", is_flag=True)
-    def pull(id: int | None, name: str | None, download: bool, all: bool, fuzzy: bool):
+    @click.option("--resume", help="Continue the last interrupted --all pull.", is_flag=True)
+    @click.option("--incremental", help="Skip unchanged playlists and only fetch added musics.", is_flag=True)
+    @click.option("--user-id", help="User whose playlists --all pulls (repeatable).", type=int, multiple=True)
+    @click.option("--build", help="Tag and place downloaded musics as they arrive.", is_flag=True)
+    @click.option("--gc", help="Collect garbage after pulling.", is_flag=True)
+    def pull(
+        id: int | None,
+        name: str | None,
+        download: bool,
+        all: bool,
+        fuzzy: bool,
+        resume: bool,
+        incremental: bool,
+        user_id: tuple[int, ...],
+        build: bool,
+        gc: bool,
+    ):
         """Pull playlist by id or name."""
-        if all:
-            Crawler.open().pull_all_playlist(download=download)
-            return
-        if id is None and name is None:
+        if build and not download:
+            raise click.UsageError("--build requires --download")
+        if all or resume or user_id:
+            get_crawler().pull_all_playlist(
+                download=download, resume=resume, incremental=incremental, user_ids=list(user_id), build=build
+            )
+        elif id is None and name is None:
             raise click.UsageError("id or name must be specified")
-        for playlist_id, _ in find_playlist(id=id, name=name, fuzzy=fuzzy):
-            Crawler.open().pull_playlist(playlist_id, download=download)
+        elif build:
+            for playlist_id, _ in find_playlist(id=id, name=name, fuzzy=fuzzy):
+                get_crawler().pull_playlist(playlist_id, download=download, incremental=incremental, build=build)
+        else:
+            get_crawler()
+            playlist_ids = [playlist_id for playlist_id, _ in find_playlist(id=id, name=name, fuzzy=fuzzy)]
+            engine.run("pull_playlists", playlist_ids, download=download, incremental=incremental)
+        if gc:
+            collect_garbage()
+
+    @playlist.command()
+    @click.argument("playlist-id", type=int)
+    @click.option("--quality", help="Download quality of this playlist.", type=click.Choice(QUALITY_LEVELS))
+    @click.option("--priority", help="Playlists with a higher priority are downloaded first.", type=int)
+    @click.option("--reset", help="Drop the settings of this playlist.", is_flag=True)
+    def config(playlist_id: int, quality: str | None, priority: int | None, reset: bool):
+        """Show or change the download quality and priority of a playlist.
+
+        A music in several playlists is downloaded in the highest quality any of them asks for.
+        """
+        key = str(playlist_id)
+        if reset:
+            db.settings.pop(key, None)
+        elif quality is not None or priority is not None:
+            settings = db.settings.get(key) or PlaylistSettings(id=playlist_id)
+            if quality is not None:
+                settings.quality = quality
+            if priority is not None:
+                settings.priority = priority
+            db.settings[key] = settings
+        db.checkpoint()
+        settings = db.settings.get(key) or PlaylistSettings(id=playlist_id)
+        level = settings.quality or f"{lib.quality} (default)"
+        print(f"{playlist_id} - quality: {level}, priority: {settings.priority}")
 
     @playlist.command()
     @click.option("--id", help="Playlist id to search for.", type=int)
@@ -117,7 +318,7 @@ def build():
     @click.option("--sort-by", help="Sort playlist by userid.")
     def list(sort_by: str | None):
         """List all builded playlists."""
-        dist_playlists = DIST_DIR.iterdir()
+        dist_playlists = DIST_DIR.iterdir() if DIST_DIR.exists() else iter(())
         if sort_by is not None:
             user_playlists = db.users.get(sort_by, User()).playlists
             dist_playlists = sorted(dist_playlists, key=lambda fp: try_index(user_playlists, int(fp.stem)))
@@ -130,12 +331,34 @@ def build():
     @click.option("--id", help="Playlist id to search for and build.", type=int)
     @click.option("--name", help="Playlist name to search for and build.")
     @click.option("--fuzzy", help="Fuzzy search.", is_flag=True)
-    def playlist(id: int | None, name: str | None, fuzzy: bool):
+    @click.option("--lyrics", help="Embed lyrics.", is_flag=True)
+    @click.option("--update-lyrics", help="Fetch lyrics again even if cached.", is_flag=True)
+    @click.option("--update-artwork", help="Replace existing album covers.", is_flag=True)
+    def playlist(
+        id: int | None, name: str | None, fuzzy: bool, lyrics: bool, update_lyrics: bool, update_artwork: bool
+    ):
         """Build playlist."""
         if id is None and name is None:
             raise click.UsageError("id or name must be specified")
         for playlist_id, _ in find_playlist(id=id, name=name, fuzzy=fuzzy):
-            build_playlist(playlist_id)
+            build_playlist(
+                playlist_id,
+                pull_lyrics=lyrics or update_lyrics,
+                update_lyrics=update_lyrics,
+                update_artwork=update_artwork,
+            )
+
+    @build.command()
+    @click.option("--id", help="Playlist id to prefetch lyrics for.", type=int)
+    @click.option("--name", help="Playlist name to prefetch lyrics for.")
+    @click.option("--fuzzy", help="Fuzzy search.", is_flag=True)
+    @click.option("--force", help="Fetch lyrics again even if cached.", is_flag=True)
+    def lyrics(id: int | None, name: str | None, fuzzy: bool, force: bool):
+        """Prefetch lyrics of playlists into the cache."""
+        if id is None and name is None:
+            raise click.UsageError("id or name must be specified")
+        for playlist_id, _ in find_playlist(id=id, name=name, fuzzy=fuzzy):
+            prefetch_lyrics(db.playlists[str(playlist_id)].music_ids, force=force)
 
     @build.command()
     @click.option("--id", help="Music id to search for and build.", type=int)
@@ -162,6 +385,25 @@ def user():
         for user_id, user in db.users.items():
             print(f"{user_id} - {user.name}")
 
+    @user.command()
+    def login():
+        """Log in (reusing the saved session if it is still valid) and save the session."""
+        get_crawler()
+
+
+def database():
+    @cli.group("db")
+    def database():
+        pass
+
+    @database.command()
+    def migrate():
+        """Import musics.json, playlists.json and users.json into the SQLite database."""
+        if db.migrate_json():
+            print("Migrated.")
+        else:
+            print("Nothing to migrate.")
+
 
 def azuracast():
     @cli.group()
@@ -173,40 +415,147 @@ def azuracast():
     @click.option("--host", help="Host.", required=True)
     @click.option("--port", help="Port.", default=2022, type=int)
     @click.option("--username", help="Username.", required=True)
-    def sync(playlist_id: str, host: str, port: int, username: str):
+    @click.option("--channels", help="Number of parallel SFTP channels.", default=4, type=int)
+    def sync(playlist_id: str, host: str, port: int, username: str, channels: int):
         """Sync playlist to azuracast."""
-        playlist = db.playlists[playlist_id]
-
         sftp = connect_azura_sftp(host, port, username, getpass() or None)
+        sync_playlist(sftp, int(playlist_id), f"{host}_{port}_{username}", channels=channels)
+        print("Done.")
+
+
+def gc():
+    @cli.command()
+    @click.option("--dry-run", help="Only report what would be removed.", is_flag=True)
+    @click.option("--grace", help="Keep unreferenced files modified within this many days.", default=7.0, type=float)
+    @click.option("--prune-playlists", help="Also drop playlists no longer owned by any known user.", is_flag=True)
+    def gc(dry_run: bool, grace: float, prune_playlists: bool):
+        """Remove downloads, lyrics and built files no longer referenced by any playlist.
+
+        Numbered folders in dist/ that do not belong to a known playlist are removed too.
+        """
+        collect_garbage(grace * 24 * 3600, dry_run=dry_run, prune_playlists=prune_playlists)
+
 
-        filenames = set(sftp.listdir())
-        if playlist.name not in filenames:
-            sftp.mkdir(playlist.name)
-        sftp.chdir(playlist.name)
-
-        filenames = set(sftp.listdir())
-        musics = [db.musics[str(i)] for i in playlist.music_ids]
-        for music in musics:
-            dist_fp = music.get_dist_path(playlist_id)
-            if not dist_fp.exists():
-                warnings.warn(f"Music {dist_fp.name} not found.")
-                continue
-            print(f"Uploading: {dist_fp.name} - {music.get_std_name()} ...")
-            if dist_fp.name in filenames:
-                if sftp.stat(dist_fp.name).st_size == dist_fp.stat().st_size:
-                    print("Already up to date.")
-                    continue
-            sftp.put(dist_fp, dist_fp.name)
-            print("Done.")
-
-        for filename in filenames.difference(i.get_dist_name() for i in musics):
-            print(f"Removing: {filename} ...")
-            sftp.remove(filename)
-            print("Done.")
+def worker():
+    @cli.group()
+    def worker():
+        """Spread a crawl over several processes on one host sharing one data directory.
+
+        The queue lives in the SQLite database in WAL mode, which needs a local filesystem: do not share the data
+        directory between hosts over NFS or SMB.
+        """
+        pass
+
+    @worker.command()
+    @click.option("--user-id", help="User whose playlists are crawled (repeatable).", type=int, multiple=True)
+    @click.option("--playlist-id", help="Playlist to crawl (repeatable).", type=int, multiple=True)
+    @click.option("--download", help="Download musics.", is_flag=True)
+    @click.option("--update-details", help="Fetch details of musics already in the database.", is_flag=True)
+    @click.option("--incremental", help="Skip unchanged playlists and only fetch added musics.", is_flag=True)
+    def coordinate(
+        user_id: tuple[int, ...], playlist_id: tuple[int, ...], download: bool, update_details: bool, incremental: bool
+    ):
+        """Queue a crawl job for `worker run` processes to pick up."""
+        if not user_id and not playlist_id:
+            raise click.UsageError("--user-id or --playlist-id must be specified")
+        options = {
+            "download": download,
+            "update_details": update_details,
+            "incremental": incremental,
+            "quality": lib.quality,
+        }
+        job = workers.coordinate(list(user_id), list(playlist_id), options)
+        print(f"Created job {job.id}: {lib.db.jobs.progress(job)}")
+
+    @worker.command()
+    @click.option("--job", help="Only work on this job (default: every unfinished crawl job).", type=int)
+    @click.option("--session", help="Session file of the account this worker uses.", type=click.Path(path_type=Path))
+    @click.option("--ttl", help="Seconds before a unit of a silent worker is handed to another one.", default=600.0)
+    @click.option("--poll", help="Seconds between checks for new units while waiting.", default=5.0)
+    @click.option("--forever", help="Keep waiting for new jobs instead of exiting when idle.", is_flag=True)
+    def run(job: int | None, session: Path | None, ttl: float, poll: float, forever: bool):
+        """Lease units from the shared queue and run them until none are left."""
+        if session is not None:
+            lib.SESSION_FILE = session
+        target = None
+        if job is not None:
+            target = lib.db.jobs.get(job)
+            if target is None:
+                raise click.UsageError(f"job {job} not found")
+        workers.work(get_crawler(), target, ttl=ttl, poll=poll, exit_when_idle=not forever)
+
+    @worker.command()
+    def status():
+        """Show progress of unfinished crawl jobs."""
+        for job in lib.db.jobs.unfinished_jobs(workers.JOB_NAME):
+            print(f"{job.id} - {lib.db.jobs.progress(job)}")
+
+
+def daemon():
+    @cli.command()
+    @click.option("--user-id", help="User whose playlists are watched (repeatable).", type=int, multiple=True)
+    @click.option("--playlist-id", help="Playlist to watch (repeatable).", type=int, multiple=True)
+    @click.option("--min-interval", help="Shortest seconds between checks of one playlist.", default=120.0)
+    @click.option("--max-interval", help="Longest seconds between checks of one playlist.", default=6 * 3600.0)
+    @click.option("--jitter", help="Random fraction added to or removed from each interval.", default=0.2)
+    @click.option("--discover-interval", help="Seconds between listings of the users' playlists.", default=1800.0)
+    @click.option("--lyrics", help="Embed lyrics into built files.", is_flag=True)
+    @click.option("--upgrade-batch", help="Musics upgraded to their playlists' quality per idle loop.", default=20)
+    @click.option("--azuracast-host", help="Sync changed playlists to this AzuraCast SFTP host.")
+    @click.option("--azuracast-port", help="AzuraCast SFTP port.", default=2022, type=int)
+    @click.option("--azuracast-username", help="AzuraCast SFTP username.")
+    @click.option("--channels", help="Number of parallel SFTP channels.", default=4, type=int)
+    def daemon(
+        user_id: tuple[int, ...],
+        playlist_id: tuple[int, ...],
+        min_interval: float,
+        max_interval: float,
+        jitter: float,
+        discover_interval: float,
+        lyrics: bool,
+        upgrade_batch: int,
+        azuracast_host: str | None,
+        azuracast_port: int,
+        azuracast_username: str | None,
+        channels: int,
+    ):
+        """Keep playlists pulled, built and synced as they change.
+
+        Each playlist is checked on its own schedule: the interval halves when it changed and grows when it did
+        not. Listing a user's playlists is one request that reveals which of them changed, so those are checked
+        right away. The session, database and HTTP/SFTP connections stay open between checks. While no
+        playlist is due, musics below their playlist's quality are downloaded again in small batches.
+        """
+        if not user_id and not playlist_id:
+            raise click.UsageError("--user-id or --playlist-id must be specified")
+        target = None
+        if azuracast_host is not None:
+            if azuracast_username is None:
+                raise click.UsageError("--azuracast-username must be specified with --azuracast-host")
+            password = os.environ.get("AZURACAST_PASSWORD") or getpass() or None
+            target = AzuraTarget(azuracast_host, azuracast_port, azuracast_username, password, channels)
+        scheduler = Scheduler(lib.BASE_DIR / "daemon.json", min_interval, max_interval, jitter)
+        runner = Daemon(
+            get_crawler(), scheduler, list(user_id), list(playlist_id), target, discover_interval, lyrics, upgrade_batch
+        )
+        try:
+            runner.run()
+        except KeyboardInterrupt:
+            print("Stopped.")
+        finally:
+            scheduler.save()
+            lib.db.checkpoint()
+            get_crawler().downloader.close()
+            if target is not None:
+                target.close()
 
 
 music()
 playlist()
 user()
 build()
+database()
 azuracast()
+gc()
+worker()
+daemon()
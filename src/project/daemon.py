@@ -0,0 +1,251 @@
+import json
+import os
+import random
+import time
+import warnings
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from . import lib
+
+
+@dataclass
+class PlaylistSchedule:
+    id: int
+    interval: float
+    next_check: float = 0.0
+    checks: int = 0
+    changes: int = 0
+    last_change: float = 0.0
+
+
+class Scheduler:
+    """按歌单的自适应轮询计划
+
+    歌单有变化时轮询间隔减半, 无变化时逐渐放长到上限; 每次的检查时间加入随机抖动, 避免所有歌单同时请求.
+    计划保存在文件中, 重启后继续沿用.
+    """
+
+    def __init__(self, path: Path, min_interval=120.0, max_interval=6 * 3600.0, jitter=0.2, backoff=1.5):
+        self.path = path
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.backoff = backoff
+        self.playlists: dict[int, PlaylistSchedule] = {}
+        if path.exists():
+            for entry in json.loads(path.read_text()):
+                self.playlists[entry["id"]] = PlaylistSchedule(**entry)
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps([asdict(s) for s in self.playlists.values()]))
+        os.replace(tmp, self.path)
+
+    def _jittered(self, interval: float):
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def track(self, playlist_ids: list[int]):
+        """更新需要轮询的歌单; 新歌单立即检查, 不再存在的歌单移出计划"""
+        wanted = set(playlist_ids)
+        for playlist_id in set(self.playlists) - wanted:
+            del self.playlists[playlist_id]
+        for playlist_id in wanted - set(self.playlists):
+            self.playlists[playlist_id] = PlaylistSchedule(playlist_id, self.min_interval)
+
+    def wake(self, playlist_id: int):
+        """已知歌单有变化, 安排立即检查"""
+        if playlist_id in self.playlists:
+            self.playlists[playlist_id].next_check = 0.0
+
+    def due(self, now: float):
+        due = [s for s in self.playlists.values() if s.next_check <= now]
+        return [s.id for s in sorted(due, key=lambda s: s.next_check)]
+
+    def record(self, playlist_id: int, changed: bool, now: float):
+        schedule = self.playlists.get(playlist_id)
+        if schedule is None:
+            return
+        schedule.checks += 1
+        if changed:
+            schedule.changes += 1
+            schedule.last_change = now
+            schedule.interval = max(self.min_interval, schedule.interval / 2)
+        else:
+            schedule.interval = min(self.max_interval, schedule.interval * self.backoff)
+        schedule.next_check = now + self._jittered(schedule.interval)
+
+    def next_check(self):
+        return min((s.next_check for s in self.playlists.values()), default=time.time() + self.min_interval)
+
+
+class AzuraTarget:
+    """保持一个 SFTP 连接, 断开时重新连接一次"""
+
+    def __init__(self, host: str, port: int, username: str, password: str | None, channels=4):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.channels = channels
+        self._sftp = None
+        self._root: str | None = None
+
+    @property
+    def name(self):
+        return f"{self.host}_{self.port}_{self.username}"
+
+    def connect(self):
+        from .azuracast import connect_azura_sftp
+
+        self.close()
+        self._sftp = connect_azura_sftp(self.host, self.port, self.username, self.password)
+        self._root = self._sftp.normalize(".")
+        return self._sftp
+
+    def close(self):
+        if self._sftp is not None:
+            self._sftp.close()
+            self._sftp = None
+
+    def sync(self, playlist_id: int):
+        for attempt in range(2):
+            sftp = self._sftp or self.connect()
+            try:
+                lib.sync_playlist(sftp, playlist_id, self.name, channels=self.channels, root=self._root)
+                return
+            except (OSError, EOFError):
+                self.close()
+                if attempt:
+                    raise
+
+
+class Daemon:
+    """常驻进程: 会话, 数据库与 HTTP/SFTP 连接保持打开, 只对有变化的歌单执行 拉取 -> 生成 -> 同步"""
+
+    def __init__(
+        self,
+        crawler: "lib.Crawler",
+        scheduler: Scheduler,
+        user_ids: list[int],
+        playlist_ids: list[int],
+        target: AzuraTarget | None = None,
+        discover_interval=1800.0,
+        pull_lyrics=False,
+        upgrade_batch=0,
+    ):
+        self.crawler = crawler
+        self.scheduler = scheduler
+        self.user_ids = user_ids
+        self.playlist_ids = playlist_ids
+        self.target = target
+        self.discover_interval = discover_interval
+        self.pull_lyrics = pull_lyrics
+        self.upgrade_batch = upgrade_batch
+        self._next_discover = 0.0
+        self._failed: set[int] = set()
+        self._upgrade_failed: set[int] = set()
+
+    def discover(self):
+        """列出用户的歌单: 一次请求即可得到所有歌单的变更标记, 有变化的歌单立即检查"""
+        playlist_ids = list(self.playlist_ids)
+        for user_id in self.user_ids:
+            try:
+                infos = self.crawler.list_user_playlists(user_id)
+            except Exception as e:
+                warnings.warn(f"Failed to list playlists of user {user_id}: {e}")
+                playlist_ids.extend(self.scheduler.playlists)
+                continue
+            for info in infos:
+                playlist_ids.append(info["id"])
+                old = lib.db.playlists.get(str(info["id"]))
+                if old is None or not old.same_version(info):
+                    self.scheduler.wake(info["id"])
+        self.scheduler.track(playlist_ids)
+        self._next_discover = time.time() + self.discover_interval
+
+    def refresh(self, playlist_id: int):
+        """检查一个歌单, 有变化时只处理受影响的歌曲, 返回是否有变化
+
+        上次处理失败或有歌曲未能生成的歌单已记录了新版本, 因此下次完整处理一遍, 已是最新的歌曲会被跳过.
+        """
+        old = lib.db.playlists.get(str(playlist_id))
+        playlist, added = self.crawler.pull_playlist_info(playlist_id, incremental=playlist_id not in self._failed)
+        if added is None:
+            return False
+        try:
+            failed = self.crawler.pull_details(added)
+        except Exception:
+            lib.hold_markers(playlist, old)
+            raise
+        if failed:
+            lib.hold_markers(playlist, old)
+        musics = [lib.db.musics[str(i)] for i in playlist.music_ids if str(i) in lib.db.musics]
+        added_ids = set(added)
+        done = self.crawler.stream_musics([m for m in musics if m.id in added_ids], playlist_id, self.pull_lyrics)
+        lib.remove_orphans(musics, playlist_id)
+        lib.db.checkpoint()
+        if self.target is not None:
+            self.target.sync(playlist_id)
+        if len(done) < len(added_ids):
+            warnings.warn(f"Playlist {playlist_id}: {len(added_ids) - len(done)} musics failed, retrying next check.")
+            self._failed.add(playlist_id)
+        else:
+            self._failed.discard(playlist_id)
+        return True
+
+    def upgrade(self):
+        """空闲时把一批音质低于设置的歌曲重新下载, 并重新生成与同步所在的歌单; 返回是否有歌曲需要升级"""
+        pending = [i for i in lib.pending_upgrades(list(self.scheduler.playlists)) if i not in self._upgrade_failed]
+        batch = set(pending[: self.upgrade_batch])
+        if not batch:
+            return False
+        print(f"Upgrading: {len(batch)} of {len(pending)} musics.")
+        upgraded = set()
+        for playlist_id in lib.by_priority(list(self.scheduler.playlists)):
+            playlist = lib.db.playlists.get(str(playlist_id))
+            ids = [i for i in playlist.music_ids if i in batch] if playlist is not None else []
+            if not ids:
+                continue
+            musics = [lib.db.musics[str(i)] for i in ids if str(i) in lib.db.musics]
+            upgraded.update(m.id for m in self.crawler.stream_musics(musics, playlist_id, self.pull_lyrics))
+            if self.target is not None:
+                self.target.sync(playlist_id)
+        self._upgrade_failed.update(batch - upgraded)
+        lib.db.checkpoint()
+        return True
+
+    def run_once(self):
+        """处理到期的歌单, 没有到期的歌单时升级一批歌曲; 返回是否还可能有歌曲等待升级"""
+        now = time.time()
+        if now >= self._next_discover and self.user_ids:
+            self.discover()
+        elif not self.user_ids and not self.scheduler.playlists:
+            self.discover()
+        due = lib.by_priority(self.scheduler.due(now))
+        upgraded = False
+        if not due and self.upgrade_batch:
+            try:
+                upgraded = self.upgrade()
+            except Exception as e:
+                warnings.warn(f"Failed to upgrade musics: {e}")
+        for playlist_id in due:
+            try:
+                changed = self.refresh(playlist_id)
+            except Exception as e:
+                warnings.warn(f"Failed to refresh playlist {playlist_id}: {e}")
+                self._failed.add(playlist_id)
+                changed = False
+            self.scheduler.record(playlist_id, changed, time.time())
+        self.scheduler.save()
+        lib.db.checkpoint(release=True)
+        return upgraded
+
+    def run(self):
+        while True:
+            upgraded = self.run_once()
+            wake = min(self.scheduler.next_check(), self._next_discover if self.user_ids else float("inf"))
+            delay = 1.0 if upgraded else max(1.0, wake - time.time())
+            print(f"Next check in {delay:.0f}s.")
+            time.sleep(delay)
@@ -0,0 +1,272 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import httpx
+
+from .integrity import file_md5
+from .metrics import metrics
+from .ratelimit import Bandwidth
+
+HEADERS = {
+    "Referer": "https://music.163.com/",
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0 Safari/537.36"
+    ),
+}
+
+
+class DownloadError(Exception):
+    pass
+
+
+@dataclass
+class DownloadTask:
+    url: str
+    path: Path
+    size: int = 0
+    """期望的文件大小, 0 表示未知"""
+    md5: str = ""
+    """期望的 md5, 为空时不校验"""
+    priority: int = 0
+    """数值大的任务先获得下载名额"""
+
+    @property
+    def part_path(self):
+        return self.path.with_name(self.path.name + ".part")
+
+
+@contextmanager
+def claim_part(task: DownloadTask):
+    """以独占锁打开临时文件, 返回 (文件, 已下载的字节数); 其他进程正在下载同一文件时抛出 DownloadError"""
+    f = task.part_path.open("ab")
+    try:
+        try:
+            import fcntl
+
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except ImportError:
+            pass
+        except BlockingIOError:
+            raise DownloadError(f"Being downloaded by another process: {task.path}") from None
+        offset = os.fstat(f.fileno()).st_size
+        if task.size and offset > task.size:
+            f.truncate(0)
+            offset = 0
+        yield f, offset
+    finally:
+        f.close()
+
+
+def finish_part(task: DownloadTask, f, md5: str | None):
+    """校验已下载的临时文件并移动到目标位置, 校验失败时清空临时文件"""
+    size = os.fstat(f.fileno()).st_size
+    if task.size and size != task.size:
+        raise DownloadError(f"Incomplete download: {size}/{task.size} bytes")
+    if task.md5 and md5 != task.md5.lower():
+        f.truncate(0)
+        raise DownloadError(f"Checksum mismatch: {task.url}")
+    if os.name == "nt":
+        f.close()
+    os.replace(task.part_path, task.path)
+
+
+def already_done(task: DownloadTask, offset: int):
+    """其他进程已经完成了同一文件的下载"""
+    if offset or not task.size or not task.path.exists() or task.path.stat().st_size != task.size:
+        return False
+    task.part_path.unlink(missing_ok=True)
+    return True
+
+
+class PrioritySemaphore:
+    """按优先级放行的 asyncio 信号量: 名额空出时唤醒优先级最高的等待者, 同级按等待的先后顺序"""
+
+    def __init__(self, value: int):
+        self._value = value
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+    @asynccontextmanager
+    async def acquire(self, priority=0):
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (-priority, next(self._seq), future))
+            try:
+                await future
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    self._release()
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._value += 1
+
+
+class Downloader:
+    """基于共享 httpx 连接池的并发下载器, 支持断点续传, 指数退避重试与带宽限制"""
+
+    def __init__(
+        self,
+        workers=8,
+        retries=3,
+        backoff=1.0,
+        timeout=30.0,
+        chunk_size=256 * 1024,
+        bandwidth: Bandwidth | None = None,
+    ):
+        self.workers = max(1, workers)
+        self.retries = retries
+        self.backoff = backoff
+        self.chunk_size = chunk_size
+        self.bandwidth = bandwidth
+        self.client = httpx.Client(
+            headers=HEADERS,
+            timeout=timeout,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=self.workers, max_keepalive_connections=self.workers),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        self.client.close()
+
+    def _fetch_once(self, task: DownloadTask):
+        with claim_part(task) as (f, offset):
+            if already_done(task, offset):
+                return
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            with self.client.stream("GET", task.url, headers=headers) as res:
+                if res.status_code == 416 and task.size and offset == task.size:
+                    pass
+                elif res.status_code == 416:
+                    f.truncate(0)
+                    raise DownloadError(f"Range not satisfiable: {task.url}")
+                else:
+                    res.raise_for_status()
+                    if offset and res.status_code != 206:
+                        f.truncate(0)
+                    host = urlsplit(task.url).hostname or ""
+                    for chunk in res.iter_bytes(self.chunk_size):
+                        f.write(chunk)
+                        metrics.count("download.bytes", len(chunk))
+                        if self.bandwidth:
+                            metrics.count("sleep.bandwidth", self.bandwidth.wait(host, len(chunk)))
+            f.flush()
+            finish_part(task, f, task.md5 and file_md5(task.part_path))
+
+    def fetch(self, task: DownloadTask):
+        """下载单个文件, 失败时按指数退避重试"""
+        task.path.parent.mkdir(parents=True, exist_ok=True)
+        for attempt in range(self.retries + 1):
+            try:
+                with metrics.timer("download", path=task.path.name):
+                    self._fetch_once(task)
+                metrics.count("download.files")
+                return
+            except (httpx.HTTPError, DownloadError, OSError):
+                if attempt >= self.retries:
+                    metrics.count("download.failures")
+                    raise
+                metrics.count("download.retries")
+                metrics.count("sleep.download", self.backoff * 2**attempt)
+                time.sleep(self.backoff * 2**attempt)
+
+
+class AsyncDownloader:
+    """Downloader 的 asyncio 版本: 共享 httpx.AsyncClient 连接池, 以优先级信号量限制同时进行的下载数"""
+
+    def __init__(
+        self,
+        workers=8,
+        retries=3,
+        backoff=1.0,
+        timeout=30.0,
+        chunk_size=256 * 1024,
+        bandwidth: Bandwidth | None = None,
+    ):
+        self.workers = max(1, workers)
+        self.retries = retries
+        self.backoff = backoff
+        self.chunk_size = chunk_size
+        self.bandwidth = bandwidth
+        self.client = httpx.AsyncClient(
+            headers=HEADERS,
+            timeout=timeout,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=self.workers, max_keepalive_connections=self.workers),
+        )
+        self.semaphore = PrioritySemaphore(self.workers)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        await self.close()
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def _fetch_once(self, task: DownloadTask):
+        with claim_part(task) as (f, offset):
+            if already_done(task, offset):
+                return
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            async with self.client.stream("GET", task.url, headers=headers) as res:
+                if res.status_code == 416 and task.size and offset == task.size:
+                    pass
+                elif res.status_code == 416:
+                    f.truncate(0)
+                    raise DownloadError(f"Range not satisfiable: {task.url}")
+                else:
+                    res.raise_for_status()
+                    if offset and res.status_code != 206:
+                        f.truncate(0)
+                    host = urlsplit(task.url).hostname or ""
+                    async for chunk in res.aiter_bytes(self.chunk_size):
+                        f.write(chunk)
+                        metrics.count("download.bytes", len(chunk))
+                        if self.bandwidth:
+                            metrics.count("sleep.bandwidth", await self.bandwidth.wait_async(host, len(chunk)))
+            f.flush()
+            finish_part(task, f, task.md5 and await asyncio.to_thread(file_md5, task.part_path))
+
+    async def fetch(self, task: DownloadTask):
+        """下载单个文件, 失败时按指数退避重试; 等待重试时不占用下载名额"""
+        task.path.parent.mkdir(parents=True, exist_ok=True)
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.semaphore.acquire(task.priority):
+                    with metrics.timer("download", path=task.path.name):
+                        await self._fetch_once(task)
+                metrics.count("download.files")
+                return
+            except (httpx.HTTPError, DownloadError, OSError):
+                if attempt >= self.retries:
+                    metrics.count("download.failures")
+                    raise
+                metrics.count("download.retries")
+                metrics.count("sleep.download", self.backoff * 2**attempt)
+                await asyncio.sleep(self.backoff * 2**attempt)
@@ -0,0 +1,254 @@
+import asyncio
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+from pathlib import Path
+from typing import Any
+
+from . import lib
+from .metrics import metrics
+
+_local = threading.local()
+_generation = 0
+
+
+def refresh_sessions():
+    """登录或 cookie 更新后调用, 各工作线程在下一次调用接口时重新复制当前会话"""
+    global _generation
+    _generation += 1
+
+
+def thread_session():
+    """每个工作线程持有一份当前 pyncm 会话的副本, 避免多个线程共用同一个 requests.Session
+
+    当前会话被替换 (如重新加载会话文件) 或调用 refresh_sessions 后, 副本会重新复制.
+    """
+    try:
+        import pyncm
+    except ImportError:
+        return None
+    current = pyncm.GetCurrentSession()
+    if getattr(_local, "source", None) is not current or getattr(_local, "generation", None) != _generation:
+        _local.session = pyncm.LoadSessionFromString(pyncm.DumpSessionAsString(current))
+        _local.source = current
+        _local.generation = _generation
+    return _local.session
+
+
+@cache
+def api_executor(workers: int):
+    """接口线程池在进程内复用, 线程持有的会话与连接在多次 run 之间保持可用"""
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api")
+
+
+def _call(func, args: tuple, kwargs: dict):
+    session = thread_session()
+    if session is not None:
+        kwargs = {**kwargs, "session": session}
+    return func(*args, **kwargs)
+
+
+class Engine:
+    """基于 asyncio 的抓取引擎
+
+    pyncm 是同步库, 接口调用在线程池中执行, 每个线程使用独立的会话; 下载使用共享连接池的
+    httpx.AsyncClient. 每类接口与下载各有独立的并发上限, 速率仍由 lib.limiter 控制.
+    """
+
+    def __init__(self, api_concurrency: int | None = None, download_workers: int | None = None):
+        self.api_concurrency = api_concurrency or lib.api_concurrency
+        self.download_workers = download_workers or lib.download_workers
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        self._executor = api_executor(self.api_concurrency)
+        self._downloader = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        if self._downloader is not None:
+            await self._downloader.close()
+            self._downloader = None
+
+    def semaphore(self, kind: str):
+        if kind not in self._semaphores:
+            self._semaphores[kind] = asyncio.Semaphore(self.api_concurrency)
+        return self._semaphores[kind]
+
+    @property
+    def downloader(self):
+        if self._downloader is None:
+            from .downloader import AsyncDownloader
+
+            self._downloader = AsyncDownloader(workers=self.download_workers, bandwidth=lib.bandwidth)
+        return self._downloader
+
+    async def call_api(self, kind: str, func, *args, **kwargs) -> dict:
+        """call_api 的异步版本: 等待令牌时不占用线程, 调用本身在线程池中执行"""
+        async with self.semaphore(kind):
+            metrics.count(f"sleep.{kind}", await lib.limiter.wait_async(kind))
+            metrics.count(f"api.{func.__name__}")
+            loop = asyncio.get_running_loop()
+            try:
+                with metrics.timer(f"api.{kind}", endpoint=func.__name__):
+                    result: dict = await loop.run_in_executor(self._executor, _call, func, args, kwargs)
+            except Exception:
+                metrics.count(f"api.errors.{kind}")
+                lib.limiter.report(kind, None)
+                raise
+        code = result.get("code", 0)
+        if code != 200:
+            metrics.count(f"api.errors.{kind}")
+        lib.limiter.report(kind, code)
+        return result
+
+    async def get_details(self, music_ids: list[int], update=False, batch_size: int | None = None):
+        """并发获取多批歌曲详情, 返回 (成功的歌曲, 失败的 id 及原因)"""
+        batch_size = batch_size or lib.detail_batch_size
+        pending = list(dict.fromkeys(i for i in music_ids if update or str(i) not in lib.db.musics))
+        fetched: dict[str, lib.Music] = {}
+        failed: dict[int, Any] = {}
+
+        async def fetch(chunk: list[int]):
+            try:
+                response = await self.call_api("detail", lib.apis.track.GetTrackDetail, chunk)
+            except Exception as e:
+                response = {"code": None, "error": repr(e)}
+            lib.store_details(chunk, response, fetched, failed)
+
+        await asyncio.gather(*(fetch(pending[i : i + batch_size]) for i in range(0, len(pending), batch_size)))
+        lib.db.musics.update(fetched)
+        musics = {i: lib.db.musics[str(i)] for i in music_ids if str(i) in lib.db.musics}
+        return musics, failed
+
+    async def get_lyrics(self, music_id: int, force=False):
+        """获取歌词, 优先使用未过期的本地缓存"""
+        if not force:
+            lyrics = lib.cached_lyrics(music_id)
+            if lyrics is not None:
+                return True, lyrics
+        lyrics = await self.call_api("lyrics", lib.apis.track.GetTrackLyricsNew, music_id)
+        if not lyrics.get("code", 0) == 200:
+            return False, lyrics
+        lib.store_lyrics(music_id, lyrics)
+        return True, lyrics
+
+    async def prefetch_lyrics(self, music_ids: list[int], force=False):
+        missing = [i for i in music_ids if force or lib.cached_lyrics(i) is None]
+
+        async def fetch(music_id: int):
+            try:
+                status, _ = await self.get_lyrics(music_id, force=True)
+            except Exception:
+                status = False
+            return music_id, status
+
+        failed = [i for i, status in await asyncio.gather(*map(fetch, missing)) if not status]
+        cached = len(music_ids) - len(missing)
+        print(f"Lyrics: {cached} cached, {len(missing) - len(failed)} fetched, {len(failed)} failed.")
+        return failed
+
+    async def resolve_audio(self, music_ids: list[int], level="standard"):
+        infos, pending = lib.cached_audio(music_ids, level)
+
+        async def fetch(chunk: list[int]):
+            try:
+                response = await self.call_api("audio", lib.apis.track.GetTrackAudioV1, chunk, level=level)
+            except Exception as e:
+                response = {"code": None, "error": repr(e)}
+            lib.store_audio(chunk, response, infos, level)
+
+        size = lib.audio_batch_size
+        await asyncio.gather(*(fetch(pending[i : i + size]) for i in range(0, len(pending), size)))
+        return infos
+
+    async def resolve(self, music_ids: list[int], level: str | None = None):
+        levels = lib.wanted_levels(music_ids, level)
+        results, old_infos = lib.check_local(music_ids, levels)
+        groups = lib.group_levels({i: v for i, v in levels.items() if i not in results})
+        infos: dict[int, dict] = {}
+        for resolved in await asyncio.gather(*(self.resolve_audio(ids, tier) for tier, ids in groups.items())):
+            infos.update(resolved)
+        return lib.classify_audio(infos, old_infos, results)
+
+    async def download(self, music_ids: list[int], requeue=True, level: str | None = None, priority=0):
+        """并发下载歌曲, 返回 {id: (状态, 下载信息或异常)}; 多个歌单同时下载时 priority 高的先获得下载名额"""
+        lib.INFOS_DIR.mkdir(parents=True, exist_ok=True)
+        results: dict[int, tuple[bool | None, Any]] = {}
+        tasks: dict[int, tuple[Path, dict]] = {}
+        for music_id, (status, info) in (await self.resolve(music_ids, level)).items():
+            if status is True:
+                tasks[music_id] = (lib.download_path(music_id, info), info)
+            else:
+                results[music_id] = (status, info)
+
+        async def fetch(music_id: int, path: Path, info: dict):
+            try:
+                await self.downloader.fetch(lib.download_task(info, path, priority))
+            except Exception as e:
+                warnings.warn(f"Failed to download: {info['url']} ({e})")
+                results[music_id] = (False, e)
+                return
+            lib.finish_download(music_id, path, info)
+            results[music_id] = (True, info)
+            print(f"Downloaded: {music_id}")
+
+        await asyncio.gather(*(fetch(music_id, path, info) for music_id, (path, info) in tasks.items()))
+        if requeue:
+            lib.queue_redownload([i for i in tasks if results[i][0] is False])
+        return results
+
+    async def pull_playlist_info(self, playlist_id: int, incremental=False):
+        response = await self.call_api("playlist", lib.apis.playlist.GetPlaylistInfo, playlist_id)
+        info = response["playlist"]
+        old = lib.db.playlists.get(str(playlist_id))
+        if incremental and old is not None and old.same_version(info):
+            return old, None
+        track_ids = lib.complete_track_ids(info)
+        if track_ids is None:
+            tracks = await self.call_api("playlist", lib.apis.playlist.GetPlaylistAllTracks, playlist_id)
+            track_ids = [i["id"] for i in tracks["songs"]]
+        return lib.store_playlist(playlist_id, info, track_ids, old, incremental)
+
+    async def pull_playlist(self, playlist_id: int, download=False, update_details=False, incremental=False):
+        """获取歌单信息与歌曲详情, 指定参数时下载; 返回歌单及详情获取失败的歌曲"""
+        old = lib.db.playlists.get(str(playlist_id))
+        playlist, added = await self.pull_playlist_info(playlist_id, incremental=incremental)
+        if added is None:
+            print(f"Playlist {playlist_id} is up to date.")
+            return playlist, {}
+        try:
+            _, failed = await self.get_details(added, update=update_details)
+        except Exception:
+            lib.hold_markers(playlist, old)
+            raise
+        if failed:
+            lib.hold_markers(playlist, old)
+        print(f"Playlist {playlist_id}: {len(added)} musics, {len(failed)} details failed.")
+        if download:
+            await self.download(added, priority=lib.playlist_priority(playlist_id))
+        return playlist, failed
+
+    async def pull_playlists(self, playlist_ids: list[int], **kwargs):
+        """同时拉取多个歌单, 单个歌单失败不影响其他歌单"""
+
+        async def pull(playlist_id: int):
+            try:
+                return await self.pull_playlist(playlist_id, **kwargs)
+            except Exception as e:
+                warnings.warn(f"Failed to pull playlist {playlist_id}: {e}")
+                return e
+
+        playlist_ids = lib.by_priority(playlist_ids)
+        return dict(zip(playlist_ids, await asyncio.gather(*map(pull, playlist_ids))))
+
+
+def run(method: str, *args, **kwargs):
+    """同步入口: 在新的事件循环中执行 Engine 的一个异步方法"""
+
+    async def main():
+        async with Engine() as engine:
+            return await getattr(engine, method)(*args, **kwargs)
+
+    return asyncio.run(main())
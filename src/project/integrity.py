@@ -0,0 +1,77 @@
+import hashlib
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+
+def file_md5(fp: Path, chunk_size=8 * 1024 * 1024):
+    """计算文件 md5, 通过 mmap 读取以避免额外的内存拷贝"""
+    digest = hashlib.md5()
+    with fp.open("rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return digest.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            for start in range(0, size, chunk_size):
+                digest.update(m[start : start + chunk_size])
+    return digest.hexdigest()
+
+
+def store_object(fp: Path, md5: str, objects_dir: Path):
+    """按内容哈希存储: 相同内容只保留一份, fp 成为对象文件的硬链接
+
+    fp 应已通过校验; 已有的对象文件内容与 md5 不符时 (例如已损坏), 改用 fp 替换对象文件.
+    """
+    obj = objects_dir / f"{md5}{fp.suffix}"
+    try:
+        if not obj.exists():
+            objects_dir.mkdir(parents=True, exist_ok=True)
+            os.link(fp, obj)
+        elif obj.samefile(fp):
+            pass
+        elif obj.stat().st_size != fp.stat().st_size or file_md5(obj) != md5:
+            tmp = obj.with_name(obj.name + ".tmp")
+            tmp.unlink(missing_ok=True)
+            os.link(fp, tmp)
+            os.replace(tmp, obj)
+        else:
+            tmp = fp.with_name(fp.name + ".tmp")
+            tmp.unlink(missing_ok=True)
+            os.link(obj, tmp)
+            os.replace(tmp, fp)
+    except OSError:
+        return False
+    return True
+
+
+@dataclass
+class VerifyResult:
+    id: int
+    path: Path
+    state: str
+    """ok, missing, corrupt 或 trial"""
+    detail: str = ""
+
+
+def verify_file(music_id: int, fp: Path, info: dict):
+    """校验文件大小与 md5, 并识别试听片段"""
+    if not fp.exists():
+        return VerifyResult(music_id, fp, "missing")
+    size = fp.stat().st_size
+    if info.get("size") and size != info["size"]:
+        return VerifyResult(music_id, fp, "corrupt", f"size {size} != {info['size']}")
+    if info.get("md5"):
+        md5 = file_md5(fp)
+        if md5 != info["md5"].lower():
+            return VerifyResult(music_id, fp, "corrupt", f"md5 {md5} != {info['md5']}")
+    if info.get("freeTrialInfo") is not None:
+        return VerifyResult(music_id, fp, "trial", str(info["freeTrialInfo"]))
+    return VerifyResult(music_id, fp, "ok")
+
+
+def verify_files(items: list[tuple[int, Path, dict]], workers=8):
+    """并行校验, hashlib 在计算大块数据时会释放 GIL"""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(lambda item: verify_file(*item), items)
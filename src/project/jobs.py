@@ -0,0 +1,178 @@
+import json
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Any
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    options TEXT NOT NULL,
+    created REAL NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS job_units (
+    job_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    error TEXT,
+    owner TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (job_id, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS job_units_state ON job_units (job_id, state, seq);
+"""
+
+UNIT_COLUMNS = {"owner": "TEXT", "lease_until": "REAL", "attempts": "INTEGER NOT NULL DEFAULT 0"}
+
+
+@dataclass
+class Unit:
+    job_id: int
+    seq: int
+    kind: str
+    payload: Any
+
+
+@dataclass
+class Job:
+    id: int
+    name: str
+    options: dict
+
+
+class JobQueue:
+    """持久化的任务队列, 每个任务由若干工作单元组成, 单元完成后立即记录, 中断后可继续
+
+    多个进程共用同一个数据库时, 通过 lease 租用单元: 租约过期 (进程退出或失联) 的单元会被其他进程重新租用.
+    """
+
+    def __init__(self, get_conn):
+        self._get_conn = get_conn
+        self._ready = False
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = self._get_conn()
+        if not self._ready:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(job_units)")}
+            for column, kind in UNIT_COLUMNS.items():
+                if columns and column not in columns:
+                    conn.execute(f"ALTER TABLE job_units ADD COLUMN {column} {kind}")
+            conn.executescript(SCHEMA)
+            self._ready = True
+        return conn
+
+    def create(self, name: str, options: dict | None = None):
+        """创建任务, 与 add 一样在下一次 commit 时写入"""
+        options = options or {}
+        cursor = self.conn.execute(
+            "INSERT INTO jobs (name, options, created) VALUES (?, ?, ?)", (name, json.dumps(options), time.time())
+        )
+        return Job(cursor.lastrowid or 0, name, options)
+
+    def unfinished(self, name: str):
+        """最近一个未完成的同名任务"""
+        row = self.conn.execute(
+            "SELECT id, options FROM jobs WHERE name = ? AND finished IS NULL ORDER BY id DESC LIMIT 1", (name,)
+        ).fetchone()
+        return None if row is None else Job(row[0], name, json.loads(row[1]))
+
+    def add(self, job: Job, kind: str, payload: Any):
+        """添加工作单元, 在下一次 commit 时与其他修改一起写入; 序号在同一条语句中分配, 多进程同时添加也不会冲突"""
+        self.conn.execute(
+            "INSERT INTO job_units (job_id, seq, kind, payload) "
+            "SELECT ?, COALESCE(MAX(seq), -1) + 1, ?, ? FROM job_units WHERE job_id = ?",
+            (job.id, kind, json.dumps(payload), job.id),
+        )
+
+    def get(self, job_id: int):
+        row = self.conn.execute("SELECT name, options FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return None if row is None else Job(job_id, row[0], json.loads(row[1]))
+
+    def unfinished_jobs(self, name: str):
+        rows = self.conn.execute(
+            "SELECT id, options FROM jobs WHERE name = ? AND finished IS NULL ORDER BY id", (name,)
+        ).fetchall()
+        return [Job(row[0], name, json.loads(row[1])) for row in rows]
+
+    def lease(self, owner: str, ttl: float, job: Job | None = None, name: str | None = None):
+        """租用一个待处理或租约已过期的单元; 未指定任务时从所有未完成的同名任务中选取"""
+        conn = self.conn
+        conn.commit()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT u.job_id, u.seq, u.kind, u.payload FROM job_units u JOIN jobs j ON j.id = u.job_id "
+                "WHERE j.finished IS NULL AND (?1 IS NULL OR u.job_id = ?1) AND (?3 IS NULL OR j.name = ?3) "
+                "AND (u.state = 'pending' OR (u.state = 'leased' AND u.lease_until < ?2)) "
+                "ORDER BY u.job_id, u.seq LIMIT 1",
+                (job and job.id, now, name),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE job_units SET state = 'leased', owner = ?, lease_until = ?, attempts = attempts + 1 "
+                    "WHERE job_id = ? AND seq = ?",
+                    (owner, now + ttl, row[0], row[1]),
+                )
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return None if row is None else Unit(row[0], row[1], row[2], json.loads(row[3]))
+
+    def renew(self, unit: Unit, owner: str, ttl: float, conn: sqlite3.Connection | None = None):
+        """延长租约, 返回租约是否仍属于 owner"""
+        conn = conn or self.conn
+        with conn:
+            cursor = conn.execute(
+                "UPDATE job_units SET lease_until = ? WHERE job_id = ? AND seq = ? AND state = 'leased' AND owner = ?",
+                (time.time() + ttl, unit.job_id, unit.seq, owner),
+            )
+        return cursor.rowcount > 0
+
+    def active(self, job: Job):
+        """是否还有待处理或正在处理的单元"""
+        row = self.conn.execute(
+            "SELECT 1 FROM job_units WHERE job_id = ? AND state IN ('pending', 'leased') LIMIT 1", (job.id,)
+        ).fetchone()
+        return row is not None
+
+    def next(self, job: Job):
+        row = self.conn.execute(
+            "SELECT seq, kind, payload FROM job_units WHERE job_id = ? AND state = 'pending' ORDER BY seq LIMIT 1",
+            (job.id,),
+        ).fetchone()
+        return None if row is None else Unit(job.id, row[0], row[1], json.loads(row[2]))
+
+    def pending(self, job: Job):
+        """依次取出未完成的单元, 处理过程中新增的单元也会被取出"""
+        while (unit := self.next(job)) is not None:
+            yield unit
+
+    def done(self, unit: Unit, error: str | None = None, owner: str | None = None):
+        """记录单元结果; 指定 owner 时只在租约仍属于 owner 时记录, 返回是否已记录"""
+        cursor = self.conn.execute(
+            "UPDATE job_units SET state = ?, error = ?, lease_until = NULL WHERE job_id = ? AND seq = ? "
+            "AND (?5 IS NULL OR (state = 'leased' AND owner = ?5))",
+            ("failed" if error else "done", error, unit.job_id, unit.seq, owner),
+        )
+        return cursor.rowcount > 0
+
+    def retry_failed(self, job: Job):
+        with self.conn:
+            self.conn.execute("UPDATE job_units SET state = 'pending' WHERE job_id = ? AND state = 'failed'", (job.id,))
+
+    def finish(self, job: Job):
+        with self.conn:
+            self.conn.execute("UPDATE jobs SET finished = ? WHERE id = ?", (time.time(), job.id))
+
+    def progress(self, job: Job):
+        return dict(
+            self.conn.execute("SELECT state, COUNT(*) FROM job_units WHERE job_id = ? GROUP BY state", (job.id,))
+        )
@@ -1,124 +1,205 @@
+import copy
 import datetime as dt
+import importlib
 import json
-import shutil
+import os
+import sqlite3
+import threading
 import time
 import warnings
-from dataclasses import asdict, dataclass, field
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from functools import cache, cached_property
 from pathlib import Path
 from typing import Any
 
-import httpx
-import music_tag
-from DrissionPage import Chromium
-from pyncm import apis
+from .builder import BuildManifest, clone_file, fingerprint, link_file, tags_hash
+from .integrity import store_object, verify_files
+from .jobs import Job, JobQueue, Unit
+from .metrics import metrics
+from .ratelimit import Bandwidth, RateLimiter
+from .storage import MusicTable, PlaylistTable, Table, connect
 
-BASE_DIR = Path(__file__).parent.parent.parent / "neteasecloudmusic"
+
+class LazyModule:
+    """首次访问属性时才导入的模块, 避免命令行启动时加载浏览器自动化等重量级依赖"""
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr: str):
+        return getattr(importlib.import_module(self._name), attr)
+
+
+music_tag = LazyModule("music_tag")
+apis = LazyModule("pyncm.apis")
+
+BASE_DIR = Path(os.environ.get("NETEASECRAWLER_HOME") or Path(__file__).parent.parent.parent / "neteasecloudmusic")
 INFOS_DIR = BASE_DIR / "infos"
 LYRICS_DIR = BASE_DIR / "lyrics"
 MUSICS_DIR = BASE_DIR / "musics"
+OBJECTS_DIR = MUSICS_DIR / "objects"
 DIST_DIR = BASE_DIR / "dist"
-
-BASE_DIR.mkdir(parents=True, exist_ok=True)
-INFOS_DIR.mkdir(parents=True, exist_ok=True)
-LYRICS_DIR.mkdir(parents=True, exist_ok=True)
-MUSICS_DIR.mkdir(parents=True, exist_ok=True)
-DIST_DIR.mkdir(parents=True, exist_ok=True)
+MANIFESTS_DIR = BASE_DIR / "manifests"
+TAGGED_DIR = BASE_DIR / "tagged"
+ARTWORKS_DIR = BASE_DIR / "artworks"
 
 MUSICS_DB_FILE = BASE_DIR / "musics.json"
 PLAYLISTS_DB_FILE = BASE_DIR / "playlists.json"
 USERS_DB_FILE = BASE_DIR / "users.json"
-
-api_delay = 0.1
+DB_FILE = BASE_DIR / "neteasecrawler.db"
+SESSION_FILE = BASE_DIR / "session"
+
+QUALITY_LEVELS = ("standard", "higher", "exhigh", "lossless", "hires")
+"""GetTrackAudioV1 的音质等级, 由低到高"""
+AUDIO_TYPES = ("mp3", "flac")
+"""GetTrackAudioV1 返回的文件格式 (type), lossless 及以上音质为 flac"""
+
+limiter = RateLimiter()
+bandwidth = Bandwidth()
+quality = "standard"
+audio_urls: dict[tuple[int, str], tuple[dict, float]] = {}
+"""下载地址缓存: (歌曲 id, 音质) -> (下载信息, 过期时间)"""
+detail_batch_size = 500
+audio_batch_size = 200
+download_batch_size = 100
+checkpoint_interval = 20
+download_workers = 8
+api_concurrency = 16
+build_workers = os.cpu_count() or 4
+api_lock = threading.Lock()
+artwork_size: int | None = None
+lyrics_ttl: float | None = 30 * 24 * 3600
+artwork_cache_size = 512 * 1024 * 1024
 
 
-@dataclass
 class Music:
-    name: str = ""
-    id: int = 0
-    pst: int = 0
-    t: int = 0
-    ar: dict = field(default_factory=dict)
-    alia: list = field(default_factory=list)
-    pop: float = 0.0
-    st: int = 0
-    rt: str = ""
-    fee: int = 0
-    v: int = 0
-    crbt: Any | None = None
-    cf: str = ""
-    al: dict = field(default_factory=dict)
-    dt: int = 0  # noqa: F811
-    h: dict = field(default_factory=dict)
-    m: dict = field(default_factory=dict)
-    l: dict = field(default_factory=dict)  # noqa: E741
-    sq: dict = field(default_factory=dict)
-    hr: Any | None = None
-    a: Any | None = None
-    cd: str = ""
-    no: int = 0
-    rtUrl: Any | None = None
-    ftype: int = 0
-    rtUrls: list[str] = field(default_factory=list)
-    djId: int = 0
-    copyright: int = 0
-    s_id: int = 0
-    mark: int = 0
-    originCoverType: int = 0
-    originSongSimpleData: Any | None = None
-    tagPicList: Any | None = None
-    resourceState: int = 0
-    version: int = 0
-    songJumpInfo: Any | None = None
-    entertainmentTags: Any | None = None
-    displayTags: Any | None = None
-    awardTags: Any | None = None
-    single: int = 0
-    noCopyrightRcmd: Any | None = None
-    mv: int = 0
-    rtype: int = 0
-    rurl: Any | None = None
-    mst: int = 0
-    cp: int = 0
-    publishTime: int = 0
-    tns: list[str] = field(default_factory=list)
+    """歌曲记录
+
+    名称, 歌手, 专辑等常用字段存放在 __slots__ 中; 接口返回的其余原始字段 (音质信息, 标签等)
+    以 JSON 字符串保存, 首次访问时才解码.
+    """
+
+    __slots__ = ("id", "name", "artists", "album", "album_pic_url", "publishTime", "_raw", "_payload")
+
+    RAW_DEFAULTS: dict[str, Any] = {
+        "pst": 0, "t": 0, "ar": [], "alia": [], "pop": 0.0, "st": 0, "rt": "", "fee": 0, "v": 0, "crbt": None,
+        "cf": "", "al": {}, "dt": 0, "h": {}, "m": {}, "l": {}, "sq": {}, "hr": None, "a": None, "cd": "", "no": 0,
+        "rtUrl": None, "ftype": 0, "rtUrls": [], "djId": 0, "copyright": 0, "s_id": 0, "mark": 0,
+        "originCoverType": 0, "originSongSimpleData": None, "tagPicList": None, "resourceState": 0, "version": 0,
+        "songJumpInfo": None, "entertainmentTags": None, "displayTags": None, "awardTags": None, "single": 0,
+        "noCopyrightRcmd": None, "mv": 0, "rtype": 0, "rurl": None, "mst": 0, "cp": 0, "tns": [],
+    }  # fmt: skip
+    """原始字段及其默认值"""
+
+    id: int
+    name: str
+    artists: tuple[str, ...]
+    album: str
+    album_pic_url: str
+    publishTime: int
+    _raw: str | None
+    _payload: dict | None
+
+    def __init__(self, name: str = "", id: int = 0, publishTime: int = 0, **payload):
+        ar = payload.get("ar") or []
+        al = payload.get("al") or {}
+        self.id = id
+        self.name = name
+        self.artists = tuple(a.get("name") or "" for a in ar)
+        self.album = al.get("name") or ""
+        self.album_pic_url = al.get("picUrl") or ""
+        self.publishTime = publishTime
+        self._raw = None
+        self._payload = payload
+
+    @classmethod
+    def from_row(cls, id: int, name: str, artists: str, album: str, album_pic_url: str, publish_time: int, raw: str):
+        music = cls.__new__(cls)
+        music.id = id
+        music.name = name
+        music.artists = tuple(json.loads(artists))
+        music.album = album
+        music.album_pic_url = album_pic_url
+        music.publishTime = publish_time
+        music._raw = raw
+        music._payload = None
+        return music
+
+    def to_row(self):
+        return (
+            self.name,
+            json.dumps(self.artists, ensure_ascii=False),
+            self.album,
+            self.album_pic_url,
+            self.publishTime,
+            self.raw,
+        )
 
     @property
-    def artist(self):
-        return " & ".join(map(lambda x: x["name"], self.ar))
+    def payload(self) -> dict:
+        if self._payload is None:
+            self._payload = json.loads(self._raw or "{}")
+        return self._payload
 
     @property
-    def album(self):
-        return self.al["name"]
+    def raw(self):
+        """原始字段的 JSON; 未解码过时直接复用, 无需重新序列化"""
+        if self._payload is not None:
+            return json.dumps(self._payload, ensure_ascii=False, separators=(",", ":"))
+        return self._raw or "{}"
+
+    def __getattr__(self, name: str):
+        if name in Music.RAW_DEFAULTS:
+            value = self.payload.get(name)
+            return copy.copy(Music.RAW_DEFAULTS[name]) if value is None else value
+        raise AttributeError(name)
+
+    def __repr__(self):
+        return f"Music(id={self.id!r}, name={self.name!r}, artist={self.artist!r}, album={self.album!r})"
+
+    def __eq__(self, other):
+        if not isinstance(other, Music):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def to_dict(self):
+        return {"name": self.name, "id": self.id, **self.payload, "publishTime": self.publishTime}
 
     @property
-    def year(self):
-        return dt.date.fromtimestamp(self.publishTime / 1000).year
+    def artist(self):
+        return " & ".join(self.artists)
 
     @property
-    def album_pic_url(self):
-        return self.al["picUrl"]
+    def year(self):
+        return dt.date.fromtimestamp(self.publishTime / 1000).year
 
     def get_std_name(self, reverse=False):
         return f"{self.name} - {self.artist}" if reverse else f"{self.artist} - {self.name}"
 
     def get_dist_name(self):
-        return f"{self.id}.mp3"
+        return self.get_download_name()
 
     def get_dist_path(self, dirname: int | str):
         return DIST_DIR / f"{dirname}" / self.get_dist_name()
 
     def get_download_name(self):
-        return f"{self.id}.mp3"
+        return download_path(self.id).name
 
     def get_download_path(self):
         return MUSICS_DIR / self.get_download_name()
 
+    def get_tagged_path(self):
+        return TAGGED_DIR / self.get_download_name()
+
 
 @dataclass
 class User:
     id: int = 0
     name: str = ""
     playlists: list[int] = field(default_factory=list)
+    created: list[int] = field(default_factory=list)
+    subscribed: list[int] = field(default_factory=list)
 
 
 @dataclass
@@ -127,27 +208,457 @@ class Playlist:
     name: str = ""
     description: str | None = None
     createTime: int = 0
+    updateTime: int = 0
+    trackCount: int = 0
+    trackUpdateTime: int = 0
     music_ids: list[int] = field(default_factory=list)
 
+    def same_version(self, info: dict):
+        """与 GetPlaylistInfo 返回的变更标记比较, 判断歌单是否未变化"""
+        return (self.updateTime, self.trackCount, self.trackUpdateTime) == (
+            info.get("updateTime", 0),
+            info.get("trackCount", 0),
+            info.get("trackUpdateTime", 0),
+        )
+
+
+@dataclass
+class PlaylistSettings:
+    id: int = 0
+    quality: str | None = None
+    """下载音质, 为空时使用默认音质"""
+    priority: int = 0
+    """数值大的歌单先下载"""
+
 
 class DB:
-    def __init__(self):
-        self.musics: dict[str, Music] = {k: Music(**v) for k, v in json.loads(MUSICS_DB_FILE.read_text()).items()}
-        self.playlists: dict[str, Playlist] = {
-            k: Playlist(**v) for k, v in json.loads(PLAYLISTS_DB_FILE.read_text()).items()
-        }
-        self.users: dict[str, User] = {k: User(**v) for k, v in json.loads(USERS_DB_FILE.read_text()).items()}
+    def __init__(self, path: Path = DB_FILE):
+        self.path = path
+        self.musics: MusicTable = MusicTable(lambda: self.conn, "musics", Music)
+        self.playlists: PlaylistTable = PlaylistTable(lambda: self.conn, "playlists", Playlist)
+        self.users: Table = Table(lambda: self.conn, "users", User)
+        self.settings: Table = Table(lambda: self.conn, "playlist_settings", PlaylistSettings)
+        self.jobs = JobQueue(lambda: self.conn)
+        self.deferred = False
+        """为 True 时中途的保存不提交, 由调用方确认后统一提交或丢弃 (分布式工作进程在租约内执行单元时)"""
+
+    @cached_property
+    def conn(self):
+        exists = self.path.exists()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = connect(self.path)
+        if not exists:
+            self.migrate_json(conn)
+        self.musics.upgrade(conn)
+        return conn
+
+    @property
+    def tables(self):
+        return (self.musics, self.playlists, self.users, self.settings)
+
+    @property
+    def dirty(self):
+        return any(table.dirty for table in self.tables)
 
     def save(self):
-        MUSICS_DB_FILE.write_text(
-            json.dumps({k: asdict(v) for k, v in self.musics.items()}, indent=4, ensure_ascii=False)
-        )
-        PLAYLISTS_DB_FILE.write_text(
-            json.dumps({k: asdict(v) for k, v in self.playlists.items()}, indent=4, ensure_ascii=False)
+        """在一个事务中写回修改过的记录"""
+        if not self.dirty:
+            return
+        with metrics.timer("db.save"), self.conn:
+            for table in self.tables:
+                table.flush(self.conn)
+
+    def checkpoint(self, release=False):
+        """保存修改并提交同一连接上未提交的其他写入 (如任务进度)"""
+        self.save()
+        self.conn.commit()
+        if release:
+            for table in self.tables:
+                table.release()
+
+    def discard(self):
+        """回滚未提交的写入并丢弃所有表未保存的修改"""
+        self.conn.rollback()
+        for table in self.tables:
+            table.discard()
+
+    def migrate_json(self, conn: sqlite3.Connection | None = None):
+        """从旧版 JSON 文件迁移数据"""
+        sources = [(MUSICS_DB_FILE, Music), (PLAYLISTS_DB_FILE, Playlist), (USERS_DB_FILE, User)]
+        if not any(fp.exists() for fp, _ in sources):
+            return False
+        if conn is None:
+            conn = self.conn
+            if not any(fp.exists() for fp, _ in sources):
+                # 新数据库在首次连接时已自动迁移
+                return True
+        tables = (
+            MusicTable(lambda: conn, "musics", Music),
+            PlaylistTable(lambda: conn, "playlists", Playlist),
+            Table(lambda: conn, "users", User),
         )
-        USERS_DB_FILE.write_text(
-            json.dumps({k: asdict(v) for k, v in self.users.items()}, indent=4, ensure_ascii=False)
+        with conn:
+            for table, (fp, cls) in zip(tables, sources):
+                if fp.exists():
+                    table.update((k, cls(**v)) for k, v in json.loads(fp.read_text()).items())
+                    table.flush(conn)
+        for fp, _ in sources:
+            if fp.exists():
+                fp.rename(fp.with_suffix(".json.migrated"))
+        return True
+
+
+def save_session():
+    """保存当前 pyncm 会话, 文件仅对当前用户可读写"""
+    import pyncm
+
+    BASE_DIR.mkdir(parents=True, exist_ok=True)
+    fd = os.open(SESSION_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(pyncm.DumpSessionAsString(pyncm.GetCurrentSession()))
+    os.chmod(SESSION_FILE, 0o600)
+    from . import engine
+
+    engine.refresh_sessions()
+
+
+def load_session():
+    """恢复保存的会话, 并确认其仍处于登录状态"""
+    import pyncm
+
+    if not SESSION_FILE.exists():
+        return False
+    try:
+        pyncm.SetCurrentSession(pyncm.LoadSessionFromString(SESSION_FILE.read_text()))
+        status = call_api("login", apis.login.GetCurrentLoginStatus)
+    except Exception as e:
+        warnings.warn(f"Failed to restore session: {e}")
+        return False
+    return status.get("code") == 200 and bool(status.get("profile"))
+
+
+def call_api(kind: str, func, *args, **kwargs) -> dict:
+    """经过限流器调用接口, 并根据返回的状态码调整该类接口的速率"""
+    metrics.count(f"sleep.{kind}", limiter.wait(kind))
+    metrics.count(f"api.{func.__name__}")
+    try:
+        with metrics.timer(f"api.{kind}", endpoint=func.__name__):
+            result: dict = func(*args, **kwargs)
+    except Exception:
+        metrics.count(f"api.errors.{kind}")
+        limiter.report(kind, None)
+        raise
+    code = result.get("code", 0)
+    if code != 200:
+        metrics.count(f"api.errors.{kind}")
+    limiter.report(kind, code)
+    return result
+
+
+def download_task(info: dict, path: Path, priority=0):
+    from .downloader import DownloadTask
+
+    return DownloadTask(info["url"], path, info.get("size") or 0, info.get("md5") or "", priority)
+
+
+def audio_type(info: dict):
+    kind = str(info.get("type") or "").lower()
+    return kind if kind in AUDIO_TYPES else "mp3"
+
+
+def download_path(music_id: int, info: dict | None = None):
+    """下载文件路径, 扩展名取决于下载信息中的格式; 未给出下载信息时按已下载的文件判断"""
+    if info is not None:
+        return MUSICS_DIR / f"{music_id}.{audio_type(info)}"
+    for kind in AUDIO_TYPES[1:]:
+        fp = MUSICS_DIR / f"{music_id}.{kind}"
+        if fp.exists():
+            return fp
+    return MUSICS_DIR / f"{music_id}.mp3"
+
+
+def remove_other_types(fp: Path):
+    """删除同一歌曲其他格式的旧文件, 例如升级到 lossless 后留下的 mp3"""
+    for kind in AUDIO_TYPES:
+        if fp.suffix != f".{kind}":
+            fp.with_suffix(f".{kind}").unlink(missing_ok=True)
+
+
+def finish_download(music_id: int, path: Path, info: dict):
+    """记录下载信息, 并按内容哈希去重"""
+    (INFOS_DIR / f"{music_id}.json").write_text(json.dumps(info, indent=4, ensure_ascii=False))
+    if info.get("md5"):
+        store_object(path, info["md5"].lower(), OBJECTS_DIR)
+    remove_other_types(path)
+    remove_other_types(TAGGED_DIR / path.name)
+
+
+def remove_download(music_id: int, path: Path):
+    """删除下载文件及其内容对象; 文件损坏时对象文件是同一份数据, 不删除会在重新下载后被链接回来"""
+    info_file = INFOS_DIR / f"{music_id}.json"
+    md5 = json.loads(info_file.read_text()).get("md5") if info_file.exists() else None
+    if md5:
+        obj = OBJECTS_DIR / f"{md5.lower()}{path.suffix}"
+        if obj.exists() and path.exists() and obj.samefile(path):
+            obj.unlink()
+    path.unlink(missing_ok=True)
+
+
+def queue_redownload(music_ids: list[int]):
+    """将下载或校验失败的歌曲加入重新下载任务"""
+    if not music_ids:
+        return
+    job = db.jobs.unfinished("redownload") or db.jobs.create("redownload")
+    db.jobs.add(job, "download", music_ids)
+    if not db.deferred:
+        db.checkpoint()
+    print(f"Queued for redownload: {len(music_ids)}")
+
+
+def verify_library(workers: int | None = None, redownload=False):
+    """并行校验所有已下载歌曲的大小与 md5, 返回有问题的歌曲"""
+    items = []
+    for info_file in INFOS_DIR.glob("*.json") if INFOS_DIR.exists() else ():
+        music_id = int(info_file.stem)
+        info = json.loads(info_file.read_text())
+        items.append((music_id, download_path(music_id, info), info))
+    problems = []
+    for result in verify_files(items, workers=workers or build_workers):
+        if result.state == "ok":
+            continue
+        print(f"{result.state.capitalize()}: {result.id} {result.detail}".rstrip())
+        problems.append(result)
+    print(f"Verified: {len(items)}, problems: {len(problems)}")
+    if redownload:
+        for result in problems:
+            if result.state == "corrupt":
+                remove_download(result.id, result.path)
+        queue_redownload([r.id for r in problems])
+    return problems
+
+
+def pending_upgrades(playlist_ids: list[int] | None = None):
+    """已下载但记录的音质低于所需音质的歌曲, 高优先级歌单中的歌曲在前; 指定歌单时只检查这些歌单"""
+    downloaded: list[int] = []
+    if playlist_ids is None:
+        playlist_ids = [settings.id for settings in db.settings.values()]
+        downloaded = [int(fp.stem) for fp in INFOS_DIR.glob("*.json")] if INFOS_DIR.exists() else []
+    ordered = [i for p in by_priority(playlist_ids) if (pl := db.playlists.get(str(p))) for i in pl.music_ids]
+    pending = []
+    for music_id, level in wanted_levels(list(dict.fromkeys(ordered + downloaded))).items():
+        info_file = INFOS_DIR / f"{music_id}.json"
+        if not level_rank(level) or not info_file.exists() or not download_path(music_id).exists():
+            continue
+        if level_rank(json.loads(info_file.read_text()).get("tier")) < level_rank(level):
+            pending.append(music_id)
+    return pending
+
+
+def level_rank(level: str | None):
+    return QUALITY_LEVELS.index(level) if level in QUALITY_LEVELS else 0
+
+
+def playlist_priority(playlist_id: int):
+    settings = db.settings.get(str(playlist_id))
+    return settings.priority if settings is not None else 0
+
+
+def by_priority(playlist_ids: list[int]):
+    """按歌单优先级排序, 同级保持原有顺序"""
+    return sorted(playlist_ids, key=playlist_priority, reverse=True)
+
+
+def sorted_by_priority(infos: list[dict]):
+    """按优先级排序接口返回的歌单"""
+    return sorted(infos, key=lambda info: playlist_priority(info["id"]), reverse=True)
+
+
+def wanted_levels(music_ids: list[int], level: str | None = None):
+    """每首歌需要的音质: 默认音质 (或任务指定的音质) 与包含它的歌单设置中最高的一档"""
+    base = level or quality
+    levels = dict.fromkeys(music_ids, base)
+    for settings in db.settings.values():
+        if level_rank(settings.quality) <= level_rank(base):
+            continue
+        playlist = db.playlists.get(str(settings.id))
+        for music_id in playlist.music_ids if playlist is not None else ():
+            if music_id in levels and level_rank(settings.quality) > level_rank(levels[music_id]):
+                levels[music_id] = settings.quality
+    return levels
+
+
+def group_levels(levels: dict[int, str]):
+    groups: dict[str, list[int]] = {}
+    for music_id, level in levels.items():
+        groups.setdefault(level, []).append(music_id)
+    return groups
+
+
+def check_local(music_ids: list[int], levels: dict[int, str] | None = None):
+    """本地已有完整版本的歌曲无需请求接口, 返回 (已是最新的歌曲, 其余已下载歌曲的旧信息)
+
+    下载时记录的音质 (tier) 低于 levels 中所需音质的歌曲视为未下载, 重新下载后覆盖.
+    """
+    results: dict[int, tuple[bool | None, Any]] = {}
+    old_infos: dict[int, dict] = {}
+    for music_id in music_ids:
+        info_file = INFOS_DIR / f"{music_id}.json"
+        if download_path(music_id).exists() and info_file.exists():
+            old_info = json.loads(info_file.read_text())
+            if levels is not None and level_rank(old_info.get("tier")) < level_rank(levels.get(music_id)):
+                continue
+            if not_vip(old_info):
+                results[music_id] = (None, old_info)
+                continue
+            old_infos[music_id] = old_info
+    return results, old_infos
+
+
+def classify_audio(infos: dict[int, dict], old_infos: dict[int, dict], results: dict[int, tuple[bool | None, Any]]):
+    """根据下载信息判断是否需要下载: True 需要, None 已是最新, False 获取失败"""
+    for music_id, info in infos.items():
+        if info.get("code") != 200 or not info.get("url"):
+            results[music_id] = (False, info)
+            continue
+        old_info = old_infos.get(music_id)
+        if old_info is not None and info["freeTrialInfo"] == old_info["freeTrialInfo"]:
+            results[music_id] = (None, old_info)
+            continue
+        results[music_id] = (True, info)
+    return results
+
+
+def cached_audio(music_ids: list[int], level="standard"):
+    """查询下载地址缓存, 返回 (未过期的下载信息, 需要请求的 id)"""
+    now = time.monotonic()
+    infos: dict[int, dict] = {}
+    pending = []
+    for music_id in dict.fromkeys(music_ids):
+        cached = audio_urls.get((music_id, level))
+        if cached is not None and cached[1] > now:
+            infos[music_id] = cached[0]
+        else:
+            pending.append(music_id)
+    metrics.count("cache.audio_url.hit", len(infos))
+    metrics.count("cache.audio_url.miss", len(pending))
+    return infos, pending
+
+
+def store_audio(chunk: list[int], response: dict, infos: dict[int, dict], level="standard"):
+    """记录一批 GetTrackAudioV1 的结果, 有效的地址在过期前缓存
+
+    请求的音质记录为 tier, 随下载信息一起保存; 实际音质 (level) 可能因版权低于请求的音质.
+    """
+    if not response.get("code", 0) == 200:
+        infos.update((i, response) for i in chunk)
+        return
+    data = {info["id"]: info for info in response.get("data", [])}
+    now = time.monotonic()
+    for music_id in chunk:
+        info = data.get(music_id, {"code": 404, "id": music_id})
+        infos[music_id] = info
+        if info.get("code") == 200 and info.get("url"):
+            info["tier"] = level
+            audio_urls[(music_id, level)] = (info, now + max(info.get("expi", 0) - 60, 0))
+
+
+def resolve_audio(music_ids: list[int], level="standard"):
+    """批量获取歌曲下载地址, 未过期的地址直接使用内存缓存"""
+    infos, pending = cached_audio(music_ids, level)
+    for start in range(0, len(pending), audio_batch_size):
+        chunk = pending[start : start + audio_batch_size]
+        store_audio(chunk, call_api("audio", apis.track.GetTrackAudioV1, chunk, level=level), infos, level)
+    return infos
+
+
+def store_details(chunk: list[int], response: dict, fetched: dict[str, "Music"], failed: dict[int, Any]):
+    """解析一批 GetTrackDetail 的结果"""
+    if not response.get("code", 0) == 200:
+        failed.update((i, response) for i in chunk)
+        return
+    songs = {song["id"]: song for song in response.get("songs", [])}
+    for music_id in chunk:
+        song = songs.get(music_id)
+        if song is None:
+            failed[music_id] = "not found"
+            continue
+        try:
+            fetched[str(music_id)] = Music(**song)
+        except TypeError as e:
+            failed[music_id] = e
+
+
+def store_lyrics(music_id: int, lyrics: dict):
+    LYRICS_DIR.mkdir(parents=True, exist_ok=True)
+    (LYRICS_DIR / f"{music_id}.json").write_text(json.dumps(lyrics, indent=4, ensure_ascii=False))
+
+
+def complete_track_ids(info: dict):
+    """歌单信息中的曲目列表, 不完整时返回 None"""
+    track_ids = [i["id"] for i in info.get("trackIds") or []]
+    return track_ids if len(track_ids) == info.get("trackCount", -1) else None
+
+
+def store_playlist(playlist_id: int, info: dict, track_ids: list[int], old: "Playlist | None", incremental=False):
+    """保存歌单, 返回歌单及需要处理的歌曲 (增量模式下只返回新增的歌曲)"""
+    playlist = Playlist(
+        id=playlist_id,
+        name=info["name"].replace("\xa0", " "),
+        description=info["description"],
+        createTime=info["createTime"],
+        updateTime=info.get("updateTime", 0),
+        trackCount=info.get("trackCount", 0),
+        trackUpdateTime=info.get("trackUpdateTime", 0),
+        music_ids=track_ids,
+    )
+    db.playlists[str(playlist_id)] = playlist
+
+    if not incremental or old is None:
+        return playlist, playlist.music_ids
+    old_ids = set(old.music_ids)
+    added = [i for i in playlist.music_ids if i not in old_ids or str(i) not in db.musics]
+    removed = old_ids.difference(playlist.music_ids)
+    print(f"Playlist {playlist_id} changed: {len(added)} added, {len(removed)} removed.")
+    return playlist, added
+
+
+def hold_markers(playlist: "Playlist", old: "Playlist | None"):
+    """新增歌曲的详情未能全部获取时恢复旧的变更标记, 下次增量拉取不会跳过该歌单, 缺少详情的歌曲会再次获取"""
+    if old is not None:
+        playlist.updateTime, playlist.trackCount, playlist.trackUpdateTime = (
+            old.updateTime,
+            old.trackCount,
+            old.trackUpdateTime,
         )
+    else:
+        playlist.updateTime = playlist.trackCount = playlist.trackUpdateTime = 0
+    db.playlists[str(playlist.id)] = playlist
+
+
+def cached_lyrics(music_id: int):
+    """读取歌词缓存, 不存在或已过期时返回 None"""
+    lyrics_file = LYRICS_DIR / f"{music_id}.json"
+    try:
+        if lyrics_ttl is not None and time.time() - lyrics_file.stat().st_mtime > lyrics_ttl:
+            metrics.count("cache.lyrics.miss")
+            return None
+        lyrics = json.loads(lyrics_file.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        metrics.count("cache.lyrics.miss")
+        return None
+    metrics.count("cache.lyrics.hit")
+    return lyrics
+
+
+def lyrics_text(lyrics: dict) -> str | None:
+    return (lyrics.get("lrc") or {}).get("lyric") or None
+
+
+def prefetch_lyrics(music_ids: list[int], force=False):
+    """批量并发预取歌词缓存, 之后的生成过程无需再请求接口"""
+    from . import engine
+
+    return engine.run("prefetch_lyrics", music_ids, force)
 
 
 def is_vip(music_info: dict):
@@ -159,90 +670,73 @@ def not_vip(music_info: dict):
 
 
 class Crawler:
-    def __init__(self):
-        self.browser = Chromium()
+    @cached_property
+    def browser(self):
+        from DrissionPage import Chromium
+
+        return Chromium()
 
+    @cached_property
+    def tab(self):
         tab = self.browser.latest_tab
         if isinstance(tab, str):
             print(tab)
             raise Exception
-        self.tab = tab
+        return tab
+
+    @cached_property
+    def downloader(self):
+        from .downloader import Downloader
+
+        return Downloader(workers=download_workers, bandwidth=bandwidth)
 
     @staticmethod
-    def get_details(music_id: int, update=False):
-        """获取歌曲详情"""
-        music = db.musics.get(str(music_id))
-        if not update and music:
-            return True, music
-        details: dict = apis.track.GetTrackDetail([music_id])  # type: ignore
-        time.sleep(api_delay)
-        if not details.get("code", 0) == 200:
-            return False, details
-        details = details["songs"][0]
-        music = Music(**details)
-        db.musics[str(music_id)] = music
-        return True, music
+    def get_details_batch(music_ids: list[int], update=False, batch_size: int | None = None):
+        """批量并发获取歌曲详情, 返回 (成功的歌曲, 失败的 id 及原因)"""
+        from . import engine
+
+        return engine.run("get_details", music_ids, update, batch_size)
 
     @staticmethod
-    def get_lyrics(music_id: int):
-        """获取歌词"""
-        lyrics_file = LYRICS_DIR / f"{music_id}.json"
-        lyrics: dict = apis.track.GetTrackLyricsNew(music_id)  # type: ignore
-        time.sleep(api_delay)
+    def get_lyrics(music_id: int, force=False):
+        """获取歌词, 优先使用未过期的本地缓存 (包括 "无歌词" 结果)"""
+        if not force:
+            lyrics = cached_lyrics(music_id)
+            if lyrics is not None:
+                return True, lyrics
+        lyrics = call_api("lyrics", apis.track.GetTrackLyricsNew, music_id)
         if not lyrics.get("code", 0) == 200:
             return False, lyrics
-        lyrics_file.write_text(json.dumps(lyrics, indent=4, ensure_ascii=False))
+        store_lyrics(music_id, lyrics)
         return True, lyrics
 
     @classmethod
     def open(cls):
+        """优先复用已保存的登录会话, 会话失效时才打开浏览器登录"""
         crawler = cls()
+        if load_session():
+            print("Session restored.")
+            return crawler
         if not crawler.login():
             raise Exception("Login failed.")
+        save_session()
         return crawler
 
-    def _download(self, music_id: int):
-        """下载歌曲"""
-        info_file = INFOS_DIR / f"{music_id}.json"
-        music_file = MUSICS_DIR / f"{music_id}.mp3"
+    @staticmethod
+    def _resolve(music_ids: list[int], level: str | None = None):
+        """获取歌曲下载信息, 已是最新时返回 None; 本地已有所需音质的完整版本时无需请求接口"""
+        levels = wanted_levels(music_ids, level)
+        results, old_infos = check_local(music_ids, levels)
+        infos: dict[int, dict] = {}
+        for tier, ids in group_levels({i: v for i, v in levels.items() if i not in results}).items():
+            infos.update(resolve_audio(ids, tier))
+        return classify_audio(infos, old_infos, results)
 
-        info: dict = apis.track.GetTrackAudioV1([music_id])  # type: ignore
-        time.sleep(api_delay)
-        if not info.get("code", 0) == 200:
-            return False, info
-        info = info["data"][0]
+    def _download(self, music_ids: list[int], requeue=True, level: str | None = None):
+        """批量并发下载歌曲, 校验失败的歌曲加入重新下载队列"""
+        from . import engine
 
-        if music_file.exists() and info_file.exists():
-            old_info = json.loads(info_file.read_text())
-            if not_vip(old_info) and is_vip(info) or info["freeTrialInfo"] == old_info["freeTrialInfo"]:
-                return None, old_info
-
-        info_file.write_text(json.dumps(info, indent=4, ensure_ascii=False))
-        for _ in range(3):
-            status, _ = self.tab.download.download(
-                info["url"],
-                music_file.parent,
-                music_file.name,
-                file_exists="overwrite",
-            )
-            if status == "success":
-                break
-            print("Failed. Retrying...")
-            # print(f"Downloading: {info["url"]} -> {music_file.relative_to(BASE_DIR)}", end="\t")
-            # try:
-            #     res = httpx.get(info["url"], headers={"Referer": "https://music.163.com/"})
-            # except Exception as e:
-            #     print(e)
-            #     continue
-            # if res.status_code == 200:
-            #     music_file.write_bytes(res.content)
-            #     print("Downloaded.")
-            #     break
-            # else:
-            #     print(f"Failed. (status code: {res.status_code})")
-        else:
-            warnings.warn(f"Failed to download: {info['url']}")
-        return True, info
+        return engine.run("download", music_ids, requeue, level=level)
 
     def login(self):
         """网页版登录"""
@@ -254,170 +748,522 @@ class Crawler:
             return False
         print("Login success.")
         cookies = dict((i["name"], i["value"]) for i in self.tab.cookies())
-        apis.login.LoginViaCookie(cookies["MUSIC_U"])
-        time.sleep(api_delay)
+        call_api("login", apis.login.LoginViaCookie, cookies["MUSIC_U"])
         return True
 
-    def download_music(self, music_id: int):
-        print("Downloading:", music_id)
-        status, music_info = self._download(music_id)
-        if status is True:
-            print("Downloaded.")
-        elif status is False:
-            print(music_info)
-            print("Failed.")
-        elif status is None:
-            print("Already downloaded.")
-
-    def pull_playlist(self, playlist_id: int, download=False, update_details=False):
-        """获取歌单信息, 指定参数可下载"""
-        # self.tab.get(f"https://music.163.com/#/my/m/music/playlist?id={playlist_id}")
-        info: dict = apis.playlist.GetPlaylistInfo(playlist_id)["playlist"]  # type: ignore
-        time.sleep(api_delay)
-
-        # playlist_name: str = self.tab.ele("xpath=//h2[@class='f-ff2 f-thide']").text  # type: ignore
-        playlist_name = info["name"]
-
-        # music_ids = [i.attr("data-res-id") for i in list(self.tab.eles("xpath=//table/tbody/tr/td[1]//span[1]"))]
-        musics: list[tuple[int, str]] = [
-            (i["id"], i["name"])
-            for i in apis.playlist.GetPlaylistAllTracks(playlist_id)["songs"]  # type: ignore
-        ]
-        time.sleep(api_delay)
-
-        playlist = Playlist(
-            id=playlist_id,
-            name=playlist_name.replace("\xa0", " "),
-            description=info["description"],
-            createTime=info["createTime"],
-            music_ids=[i[0] for i in musics],
-        )
-
-        db.playlists[str(playlist_id)] = playlist
-
-        for music_id, music_name in musics:  # type: ignore
-            print(f"Getting music details: {music_id} - {music_name}", end="\t")
-            status, _ = self.get_details(music_id, update=update_details)
+    def stream_musics(
+        self, musics: list[Music], dirname: int | str, pull_lyrics=False, level: str | None = None, requeue=True
+    ):
+        """流水线模式: 解析地址 -> 下载 -> 写标签 -> 放置
+
+        文件下载完成后立即写入标签, 生成目录中的文件都硬链接到同一个已写标签的主文件.
+        下载失败的歌曲与 download_musics 一样加入重新下载队列.
+        """
+        from .pipeline import Stage, run_pipeline
+
+        for fp in (INFOS_DIR, TAGGED_DIR, DIST_DIR / f"{dirname}"):
+            fp.mkdir(parents=True, exist_ok=True)
+        manifest = BuildManifest(MANIFESTS_DIR / f"{dirname}.json")
+        masters = BuildManifest(MANIFESTS_DIR / "tagged.json")
+        lock = threading.Lock()
+        by_id = {m.id: m for m in musics}
+        failed_downloads: list[int] = []
+        if pull_lyrics:
+            prefetch_lyrics(list(by_id))
+
+        def resolve():
+            ids = list(by_id)
+            for start in range(0, len(ids), audio_batch_size):
+                for music_id, (status, info) in self._resolve(ids[start : start + audio_batch_size], level).items():
+                    yield by_id[music_id], status, info
+
+        def download(item: tuple[Music, bool | None, Any]):
+            music, status, info = item
+            if status is False:
+                raise Exception(f"Failed to resolve: {info}")
             if status is True:
-                print("Success.")
-            else:
+                path = download_path(music.id, info)
+                self.downloader.fetch(download_task(info, path))
+                finish_download(music.id, path, info)
+            return music
+
+        def tag(music: Music):
+            source, master, key = music.get_download_path(), music.get_tagged_path(), str(music.id)
+            tags = music_tags_hash(music, pull_lyrics)
+            with lock:
+                entry = masters.entries.get(key)
+                fresh = masters.is_fresh(key, source, master, tags)
+            if not fresh:
+                if entry is None or entry["source"] != fingerprint(source) or not master.exists():
+                    clone_file(source, master)
+                tag_file(music, master, pull_lyrics)
+                with lock:
+                    masters.record(key, source, master, tags)
+            return music, tags
+
+        def place(item: tuple[Music, str]):
+            music, tags = item
+            master, dist_fp = music.get_tagged_path(), music.get_dist_path(dirname)
+            if not (dist_fp.exists() and dist_fp.samefile(master)):
+                link_file(master, dist_fp)
+                remove_other_types(dist_fp)
+            manifest.record(str(music.id), music.get_download_path(), dist_fp, tags)
+            print(f"Built: {music.id} -> {dist_fp.relative_to(BASE_DIR)}")
+            return music
+
+        def on_error(stage: Stage, item, error: Exception):
+            music = item[0] if isinstance(item, tuple) else item
+            warnings.warn(f"Failed to {stage.name} {music.id}: {error}")
+            if stage.name == "download" and item[1] is True:
+                failed_downloads.append(music.id)
+
+        done = run_pipeline(
+            resolve(),
+            [
+                Stage("download", download, download_workers),
+                Stage("tag", tag, build_workers),
+                Stage("place", place),
+            ],
+            on_error=on_error,
+        )
+        masters.save()
+        manifest.save()
+        get_artwork_cache().evict()
+        if requeue:
+            queue_redownload(failed_downloads)
+        print(f"Built: {len(done)}, failed: {len(musics) - len(done)}.")
+        return done
+
+    def download_musics(self, music_ids: list[int], requeue=True, level: str | None = None):
+        print("Downloading:", len(music_ids), "musics")
+        failed = []
+        for music_id, (status, music_info) in self._download(music_ids, requeue, level).items():
+            if status is False:
+                print(music_id, music_info)
                 print("Failed.")
+                failed.append(music_id)
+            elif status is None:
+                print(f"Already downloaded: {music_id}")
+        return failed
 
-            if download:
-                self.download_music(music_id)
+    @staticmethod
+    def pull_playlist_info(playlist_id: int, incremental=False):
+        """获取歌单信息与曲目列表, 返回歌单及新增的歌曲 (增量模式下歌单未变化时为 None)"""
+        info = call_api("playlist", apis.playlist.GetPlaylistInfo, playlist_id)["playlist"]
+        old = db.playlists.get(str(playlist_id))
+        if incremental and old is not None and old.same_version(info):
+            return old, None
+
+        track_ids = complete_track_ids(info)
+        if track_ids is None:
+            track_ids = [
+                i["id"] for i in call_api("playlist", apis.playlist.GetPlaylistAllTracks, playlist_id)["songs"]
+            ]
+        return store_playlist(playlist_id, info, track_ids, old, incremental)
+
+    def pull_details(self, music_ids: list[int], update=False):
+        print(f"Getting music details: {len(music_ids)} musics", end="\t")
+        _, failed = self.get_details_batch(music_ids, update=update)
+        print("Success." if not failed else f"Failed: {len(failed)}.")
+        for music_id, reason in failed.items():
+            print(f"Failed to get music details: {music_id} ({reason})")
+        return failed
+
+    def pull_playlist(self, playlist_id: int, download=False, update_details=False, incremental=False, build=False):
+        """获取歌单信息, 指定参数可下载; 增量模式下跳过未变化的歌单, 只处理新增的歌曲
+
+        不生成时由 engine 并发请求详情与下载; build 时下载与生成以流水线方式同时进行.
+        """
+        if not build:
+            from . import engine
+
+            playlist, _ = engine.run(
+                "pull_playlist", playlist_id, download=download, update_details=update_details, incremental=incremental
+            )
+            return playlist
+        old = db.playlists.get(str(playlist_id))
+        playlist, added = self.pull_playlist_info(playlist_id, incremental=incremental)
+        if added is None:
+            print(f"Playlist {playlist_id} is up to date.")
+            return playlist
+        try:
+            failed = self.pull_details(added, update=update_details)
+        except Exception:
+            hold_markers(playlist, old)
+            raise
+        if failed:
+            hold_markers(playlist, old)
+        if download:
+            self.stream_musics([db.musics[str(i)] for i in added if str(i) in db.musics], playlist_id)
+            remove_orphans([db.musics[str(i)] for i in playlist.music_ids if str(i) in db.musics], playlist_id)
         return playlist
 
-    def pull_all_playlist(self, download=False, update_details=False):
-        """获取所有歌单信息, 指定参数可下载"""
-        if not str(self.tab.url).startswith("https://music.163.com/#/my/m/music/playlist"):
-            my_music = self.tab.ele("xpath=//ul[@class='m-nav j-tflag']/li[2]")
-            my_music.click()  # type: ignore
-            self.tab.wait.eles_loaded("xpath=//a[@class='s-fc7']")
+    def pull_all_playlist(
+        self,
+        download=False,
+        update_details=False,
+        resume=False,
+        incremental=False,
+        user_ids: list[int] | None = None,
+        build=False,
+    ):
+        """获取所有歌单信息, 指定参数可下载; 进度逐单元记录, resume 时从中断处继续"""
+        job = db.jobs.unfinished("pull_all") if resume else None
+        if job is not None:
+            print(f"Resuming job {job.id}: {db.jobs.progress(job)}")
+            db.jobs.retry_failed(job)
+        else:
+            job = db.jobs.create(
+                "pull_all",
+                {
+                    "download": download,
+                    "update_details": update_details,
+                    "incremental": incremental,
+                    "build": build,
+                    "quality": quality,
+                },
+            )
+            for user_id in user_ids or [self.current_user_id()]:
+                for info in sorted_by_priority(self.list_user_playlists(user_id)):
+                    old = db.playlists.get(str(info["id"]))
+                    if incremental and old is not None and old.same_version(info):
+                        continue
+                    db.jobs.add(job, "playlist", info["id"])
+            db.checkpoint()
+        self.run_job(job)
 
-        playlist: list[tuple[int, str]] = [
-            (int(i.attr("data-matcher").replace("playlist-", "", 1)), i.ele("xpath=//p[@class='name f-thide']").text)
-            for i in list(self.tab.eles("xpath=//ul[@class='j-flag f-cb']/li"))
-        ]
+    @staticmethod
+    def current_user_id() -> int:
+        status = call_api("login", apis.login.GetCurrentLoginStatus)
+        if not status.get("profile"):
+            raise Exception("Not logged in.")
+        return status["profile"]["userId"]
 
-        user_ele = self.tab.ele("xpath=//a[@class='s-fc7']")
-        userid: str = str(user_ele.attr("href")).split("id=", 1)[-1]
-        username: str = str(user_ele.text)
-        user = User(id=int(userid), name=username, playlists=[playlist_id for playlist_id, _ in playlist])
-        db.users[userid] = user
+    @staticmethod
+    def list_user_playlists(user_id: int, page_size=1000):
+        """通过接口分页获取用户的全部歌单, 并记录创建与收藏的歌单"""
+        playlists: list[dict] = []
+        while True:
+            result = call_api("user", apis.user.GetUserPlaylists, user_id, offset=len(playlists), limit=page_size)
+            if not result.get("code", 0) == 200:
+                raise Exception(f"Failed to get playlists of user {user_id}: {result}")
+            playlists.extend(result.get("playlist", []))
+            if not result.get("more") or not result.get("playlist"):
+                break
 
-        for playlist_id, playlist_name in playlist:
-            print(f"Pulling playlist: {playlist_id} - {playlist_name} ...")
-            self.pull_playlist(playlist_id, download=download, update_details=update_details)
-            print("Done.")
+        created = [p["id"] for p in playlists if p.get("userId") == user_id]
+        created_ids = set(created)
+        profile = call_api("user", apis.user.GetUserDetail, user_id).get("profile") or {}
+        db.users[str(user_id)] = User(
+            id=user_id,
+            name=profile.get("nickname", ""),
+            playlists=[p["id"] for p in playlists],
+            created=created,
+            subscribed=[p["id"] for p in playlists if p["id"] not in created_ids],
+        )
+        print(f"User {user_id}: {len(created)} created, {len(playlists) - len(created)} subscribed playlists.")
+        return playlists
+
+    def run_unit(self, job: Job, unit: Unit):
+        options = job.options
+        if unit.kind == "user":
+            print(f"Listing playlists of user: {unit.payload} ...")
+            for info in sorted_by_priority(self.list_user_playlists(unit.payload)):
+                old = db.playlists.get(str(info["id"]))
+                if options.get("incremental") and old is not None and old.same_version(info):
+                    continue
+                db.jobs.add(job, "playlist", info["id"])
+        elif unit.kind == "playlist":
+            print(f"Pulling playlist: {unit.payload} ...")
+            old = db.playlists.get(str(unit.payload))
+            markers = (
+                None if old is None else {k: getattr(old, k) for k in ("updateTime", "trackCount", "trackUpdateTime")}
+            )
+            _, music_ids = self.pull_playlist_info(unit.payload, incremental=options.get("incremental", False))
+            if music_ids is None:
+                print("Up to date.")
+                return
+            for start in range(0, len(music_ids), detail_batch_size):
+                chunk = music_ids[start : start + detail_batch_size]
+                db.jobs.add(job, "details", {"playlist": unit.payload, "music_ids": chunk, "markers": markers})
+            if options.get("download") and options.get("build"):
+                for start in range(0, len(music_ids), download_batch_size):
+                    chunk = music_ids[start : start + download_batch_size]
+                    db.jobs.add(job, "stream", {"playlist": unit.payload, "music_ids": chunk})
+                db.jobs.add(job, "clean", unit.payload)
+            elif options.get("download"):
+                for start in range(0, len(music_ids), download_batch_size):
+                    db.jobs.add(job, "download", music_ids[start : start + download_batch_size])
+        elif unit.kind == "details":
+            payload = unit.payload if isinstance(unit.payload, dict) else {"music_ids": unit.payload}
+            try:
+                failed = self.pull_details(payload["music_ids"], update=options.get("update_details", False))
+            except Exception:
+                self.hold_unit_markers(payload)
+                raise
+            if failed:
+                self.hold_unit_markers(payload)
+                return f"{len(failed)} details failed"
+        elif unit.kind == "download":
+            failed = self.download_musics(unit.payload, job.name != "redownload", options.get("quality"))
+            if failed:
+                return f"{len(failed)} downloads failed"
+        elif unit.kind == "stream":
+            musics = [db.musics[str(i)] for i in unit.payload["music_ids"] if str(i) in db.musics]
+            done = self.stream_musics(musics, unit.payload["playlist"], level=options.get("quality"))
+            if len(done) < len(unit.payload["music_ids"]):
+                return f"{len(unit.payload['music_ids']) - len(done)} builds failed"
+        elif unit.kind == "clean":
+            music_ids = db.playlists[str(unit.payload)].music_ids
+            remove_orphans([db.musics[str(i)] for i in music_ids if str(i) in db.musics], unit.payload)
+        else:
+            raise ValueError(f"Unknown unit: {unit.kind}")
+
+    @staticmethod
+    def hold_unit_markers(payload: dict):
+        """详情单元失败时恢复歌单单元记录的旧变更标记, 旧版任务的单元未记录歌单时不处理"""
+        playlist = db.playlists.get(str(payload.get("playlist")))
+        if playlist is None or "markers" not in payload:
+            return
+        markers = payload["markers"]
+        hold_markers(playlist, None if markers is None else Playlist(**markers))
+
+    def run_job(self, job: Job):
+        """执行任务中未完成的单元, 每完成一个单元即保存进度"""
+        for count, unit in enumerate(db.jobs.pending(job), 1):
+            try:
+                error = self.run_unit(job, unit)
+            except Exception as e:
+                warnings.warn(f"Failed to run {unit.kind} unit {unit.seq}: {e}")
+                error = repr(e)
+            db.jobs.done(unit, error)
+            db.checkpoint(release=count % checkpoint_interval == 0)
+        progress = db.jobs.progress(job)
+        if not progress.get("failed"):
+            db.jobs.finish(job)
+        print(f"Done: {progress}")
+
+
+def collect_garbage(grace: float = 7 * 24 * 3600, dry_run=False, prune_playlists=False):
+    """删除不再被任何歌单引用的下载, 歌词, 标签文件与生成目录
+
+    存活集合为数据库中的歌单及其歌曲; prune_playlists 时只保留仍属于某个用户的歌单.
+    """
+    from .sweep import Sweep, stem
+
+    if not db.playlists:
+        warnings.warn("No playlists in the database, skipping garbage collection. Run `music db migrate` first?")
+        return None
+    playlists = {key: playlist.music_ids for key, playlist in db.playlists.items()}
+    if prune_playlists and db.users:
+        owned = {str(i) for user in db.users.values() for i in user.playlists}
+        for key in set(playlists) - owned:
+            print(f"Pruning playlist: {key} - {db.playlists[key].name}")
+            del playlists[key]
+    live = {str(i) for music_ids in playlists.values() for i in music_ids}
+    inodes = set()
+
+    def live_music(entry: os.DirEntry):
+        if entry.is_dir():
+            return True
+        if stem(entry) in live:
+            inodes.add(entry.inode())
+            return True
+        return False
+
+    sweep = Sweep(grace)
+    sweep.scan(MUSICS_DIR, live_music)
+    sweep.scan(OBJECTS_DIR, lambda entry: entry.inode() in inodes)
+    for root in (INFOS_DIR, LYRICS_DIR, TAGGED_DIR):
+        sweep.scan(root, lambda entry: stem(entry) in live)
+
+    def live_dirname(name: str):
+        """歌单的生成目录, 以及 build music --dirname 生成的非数字目录"""
+        return name in playlists or not name.isdigit()
+
+    sweep.scan(DIST_DIR, lambda entry: live_dirname(entry.name))
+    for key, music_ids in playlists.items():
+        members = {str(i) for i in music_ids}
+        sweep.scan(DIST_DIR / key, lambda entry: stem(entry) in members, label="dist")
+    sweep.scan(MANIFESTS_DIR, lambda entry: live_dirname(stem(entry)))
+    sweep.report()
+    if dry_run:
+        return sweep
+
+    sweep.remove()
+    masters = BuildManifest(MANIFESTS_DIR / "tagged.json")
+    if masters.path.exists():
+        masters.save(live)
+    if prune_playlists:
+        for key in set(db.playlists) - set(playlists):
+            del db.playlists[key]
+    print("Done.")
+    return sweep
+
+
+def sync_playlist(sftp, playlist_id: int, target: str, channels=4, root: str | None = None):
+    """将歌单的生成目录同步到 AzuraCast 的同名文件夹, target 用于区分不同服务器的同步记录"""
+    from .azuracast import SyncManifest, sync_files
+
+    playlist = db.playlists[str(playlist_id)]
+    if root is not None:
+        sftp.chdir(root)
+    if playlist.name not in set(sftp.listdir()):
+        sftp.mkdir(playlist.name)
+    sftp.chdir(playlist.name)
+
+    files = {}
+    expected = {Music(id=i).get_dist_name() for i in playlist.music_ids}
+    for music in (db.musics[str(i)] for i in playlist.music_ids if str(i) in db.musics):
+        dist_fp = music.get_dist_path(playlist_id)
+        if not dist_fp.exists():
+            warnings.warn(f"Music {dist_fp.name} not found.")
+            continue
+        files[dist_fp.name] = dist_fp
+    manifest = SyncManifest(BASE_DIR / "azuracast" / f"{target}_{playlist_id}.json")
+    sync_files(sftp, files, manifest, channels=channels, expected=expected)
 
 
 def build_playlist(playlist_id: int, pull_lyrics=False, update_lyrics=False, update_artwork=False):
     """从歌单生成mp3文件 (包含专辑封面等信息)"""
-    musics = [db.musics[str(i)] for i in set(db.playlists[str(playlist_id)].music_ids)]
+    music_ids = set(db.playlists[str(playlist_id)].music_ids)
+    musics = [db.musics[str(i)] for i in music_ids if str(i) in db.musics]
+    if len(musics) < len(music_ids):
+        warnings.warn(f"Playlist {playlist_id}: {len(music_ids) - len(musics)} musics have no details, pull it again.")
     build_musics(
         musics, playlist_id, pull_lyrics=pull_lyrics, update_lyrics=update_lyrics, update_artwork=update_artwork
     )
 
 
-def build_musics(musics: list[Music], dirname: int | str, pull_lyrics=False, update_lyrics=False, update_artwork=False):
-    for music in musics:
-        music_fp = music.get_download_path()
-        if not music_fp.exists():
-            warnings.warn(f"Music {music_fp.name} not found.")
-            continue
-        dist_fp = music.get_dist_path(dirname)
-        dist_fp.parent.mkdir(parents=True, exist_ok=True)
+@cache
+def get_artwork_cache():
+    from .artwork import ArtworkCache
+
+    return ArtworkCache(ARTWORKS_DIR, max_bytes=artwork_cache_size, size=artwork_size)
+
+
+def music_tags_hash(music: Music, pull_lyrics=False):
+    return tags_hash(music.name, music.artist, music.album, music.year, music.album_pic_url, artwork_size, pull_lyrics)
 
-        print(f"Building: {music.id} -> {dist_fp.relative_to(BASE_DIR)} ...", end="\t")
-        if not dist_fp.exists():
-            shutil.copy(music_fp, dist_fp)
 
-        f = music_tag.load_file(dist_fp)
+def tag_file(music: Music, fp: Path, pull_lyrics=False, update_lyrics=False, update_artwork=False):
+    """写入标题, 歌手, 专辑, 年份, 歌词与封面"""
+    with metrics.timer("tag", music=music.id):
+        f = music_tag.load_file(fp)
         if not f:
-            raise Exception(f"Failed to load {dist_fp}.")
+            raise Exception(f"Failed to load {fp}.")
 
         f["title"] = music.name
         f["artist"] = music.artist
         f["album"] = music.album
         f["year"] = music.year
         if pull_lyrics and (update_lyrics or not f["lyrics"]):
-            status, lyrics = Crawler.get_lyrics(music.id)
-            time.sleep(api_delay)
+            with api_lock:
+                status, lyrics = Crawler.get_lyrics(music.id)
             if not status:
                 raise Exception(f"Failed to get lyrics for {music.name}.")
-            f["lyrics"] = lyrics["lrc"]["lyric"]
+            text = lyrics_text(lyrics)
+            if text:
+                f["lyrics"] = text
         if update_artwork or not f["artwork"]:
-            response = httpx.get(music.album_pic_url)
-            time.sleep(api_delay)
-            if not response.is_success:
-                raise Exception(f"Failed to get album cover for {music.name}.")
-            f["artwork"] = response.content
-
-        print("Done.")
+            try:
+                f["artwork"] = get_artwork_cache().get(music.album_pic_url)
+            except Exception as e:
+                raise Exception(f"Failed to get album cover for {music.name}.") from e
         f.save()
 
-    for i in set((DIST_DIR / f"{dirname}").iterdir()).difference(m.get_dist_path(dirname) for m in musics):
+
+def _build_music(
+    music: Music, dist_fp: Path, tags: str, rebuild: bool, pull_lyrics=False, update_lyrics=False, update_artwork=False
+):
+    """原地写入标签; 流水线模式生成的文件是共享主文件的硬链接, 写入前先换成独立的副本"""
+    music_fp = music.get_download_path()
+    if rebuild or not dist_fp.exists() or dist_fp.stat().st_nlink > 1:
+        clone_file(music_fp, dist_fp)
+    tag_file(music, dist_fp, pull_lyrics, update_lyrics, update_artwork)
+    return tags
+
+
+def remove_orphans(musics: list[Music], dirname: int | str):
+    """删除生成目录中不再属于歌单的文件"""
+    dist_dir = DIST_DIR / f"{dirname}"
+    for i in set(dist_dir.iterdir()).difference(m.get_dist_path(dirname) for m in musics):
         print(f"Removing: {i.relative_to(BASE_DIR)} ...")
         i.unlink()
         print("Done.")
+    manifest = BuildManifest(MANIFESTS_DIR / f"{dirname}.json")
+    manifest.save({str(m.id) for m in musics})
+
+
+def build_musics(musics: list[Music], dirname: int | str, pull_lyrics=False, update_lyrics=False, update_artwork=False):
+    dist_dir = DIST_DIR / f"{dirname}"
+    dist_dir.mkdir(parents=True, exist_ok=True)
+    manifest = BuildManifest(MANIFESTS_DIR / f"{dirname}.json")
+    if pull_lyrics:
+        prefetch_lyrics([m.id for m in musics], force=update_lyrics)
+
+    jobs = {}
+    skipped = 0
+    with ThreadPoolExecutor(max_workers=build_workers) as executor:
+        for music in musics:
+            music_fp = music.get_download_path()
+            if not music_fp.exists():
+                warnings.warn(f"Music {music_fp.name} not found.")
+                continue
+            dist_fp = music.get_dist_path(dirname)
+            tags = music_tags_hash(music, pull_lyrics)
+            key = str(music.id)
+            entry = manifest.entries.get(key)
+            if not (update_lyrics or update_artwork) and manifest.is_fresh(key, music_fp, dist_fp, tags):
+                skipped += 1
+                continue
+            rebuild = entry is not None and entry["source"] != fingerprint(music_fp)
+            future = executor.submit(
+                _build_music, music, dist_fp, tags, rebuild, pull_lyrics, update_lyrics, update_artwork
+            )
+            jobs[future] = (music, dist_fp)
+
+        for future in as_completed(jobs):
+            music, dist_fp = jobs[future]
+            try:
+                tags = future.result()
+            except Exception as e:
+                warnings.warn(f"Failed to build {music.id}: {e}")
+                manifest.entries.pop(str(music.id), None)
+                continue
+            manifest.record(str(music.id), music.get_download_path(), dist_fp, tags)
+            print(f"Built: {music.id} -> {dist_fp.relative_to(BASE_DIR)}")
+    print(f"Built: {len(jobs)}, up to date: {skipped}.")
+    if jobs:
+        get_artwork_cache().evict()
+
+    manifest.save()
+    remove_orphans(musics, dirname)
 
 
 def find_playlist(*, id: int | None = None, name: str | None = None, fuzzy: bool = False):
     """本地查询, 搜索歌单"""
-    p_id = None if id is None else str(id)
-    for playlist_id, playlist in db.playlists.items():
-        if p_id is not None and p_id == playlist_id:
-            yield int(playlist_id), playlist.name
-            break
-        if name is not None and (name.lower() in playlist.name.lower() if fuzzy else name == playlist.name):
-            yield int(playlist_id), playlist.name
+    if id is not None and str(id) in db.playlists:
+        yield id, db.playlists[str(id)].name
+    if name is not None:
+        yield from ((i, n) for i, n in db.playlists.search(name, fuzzy=fuzzy) if i != id)
 
 
 def find_music(*, id: int | None = None, name: str | None = None, fuzzy: bool = False):
     """本地查询, 搜索歌曲"""
-    m_id = None if id is None else str(id)
-    for music_id, music in db.musics.items():
-        if m_id is not None and m_id == music_id:
-            yield int(music_id), music.get_std_name()
-            break
-        if name is not None and (
-            name.lower() in music.get_std_name().lower()
-            if fuzzy
-            else name == music.name or name == music.get_std_name()
-        ):
-            yield int(music_id), music.get_std_name()
+    if id is not None and str(id) in db.musics:
+        yield id, db.musics[str(id)].get_std_name()
+    if name is not None:
+        yield from ((i, n) for i, n in db.musics.search(name, fuzzy=fuzzy) if i != id)
 
 
 def find_music_in_playlists(*, id: int | None = None, name: str | None = None, fuzzy: bool = False):
     """查询一首歌存在于哪些歌单"""
-    musics = find_music(name=name, fuzzy=fuzzy)
-    music_ids = {id} if name is None else {i[0] for i in musics}
-    for playlist_id, playlist in db.playlists.items():
-        ids = music_ids.intersection(playlist.music_ids)
-        if ids:
-            yield from (
-                (int(playlist_id), playlist.name, music_id, db.musics[str(music_id)].get_std_name()) for music_id in ids
-            )
+    musics = dict(find_music(name=name, fuzzy=fuzzy)) if name is not None else {}
+    music_ids = {id} if name is None else set(musics)
+    for playlist_id, music_id in db.playlists.playlists_of(music_ids):
+        music_name = musics.get(music_id) or db.musics[str(music_id)].get_std_name()
+        yield playlist_id, db.playlists[str(playlist_id)].name, music_id, music_name
 
 
 db = DB()
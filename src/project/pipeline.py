@@ -0,0 +1,78 @@
+import queue
+import threading
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+from typing import Any
+
+_DONE = object()
+
+
+@dataclass
+class Stage:
+    name: str
+    func: Callable[[Any], Any]
+    """处理一个条目, 返回传给下一阶段的条目; 返回 None 表示到此为止"""
+    workers: int = 1
+
+
+def run_pipeline(
+    items: Iterable,
+    stages: list[Stage],
+    queue_size=16,
+    on_error: Callable[[Stage, Any, Exception], None] | None = None,
+):
+    """多阶段流水线: 各阶段有独立的工作线程, 阶段之间通过有界队列传递, 返回最后一个阶段的结果"""
+    queues = [queue.Queue(queue_size) for _ in range(len(stages) + 1)]
+    remaining = [stage.workers for stage in stages]
+    lock = threading.Lock()
+    results = []
+
+    def work(index: int):
+        stage = stages[index]
+        source, target = queues[index], queues[index + 1]
+        while (item := source.get()) is not _DONE:
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                if on_error is not None:
+                    on_error(stage, item, e)
+                continue
+            if result is not None:
+                target.put(result)
+        with lock:
+            remaining[index] -= 1
+            last = remaining[index] == 0
+        if last:
+            for _ in range(stages[index + 1].workers if index + 1 < len(stages) else 1):
+                target.put(_DONE)
+
+    threads = [
+        threading.Thread(target=work, args=(index,), name=f"{stage.name}-{n}", daemon=True)
+        for index, stage in enumerate(stages)
+        for n in range(stage.workers)
+    ]
+    for thread in threads:
+        thread.start()
+
+    errors: list[BaseException] = []
+
+    def feed():
+        try:
+            for item in items:
+                queues[0].put(item)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            for _ in range(stages[0].workers):
+                queues[0].put(_DONE)
+
+    feeder = threading.Thread(target=feed, name="feed", daemon=True)
+    feeder.start()
+    while (item := queues[-1].get()) is not _DONE:
+        results.append(item)
+    feeder.join()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
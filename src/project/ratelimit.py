@@ -0,0 +1,169 @@
+import asyncio
+import datetime as dt
+import threading
+import time
+
+THROTTLE_CODES = {405, 429, 503, -447, -460, -462}
+"""接口返回这些状态码时视为触发了限流"""
+
+DEFAULT_RATES = {
+    "login": 1.0,
+    "user": 5.0,
+    "playlist": 5.0,
+    "detail": 5.0,
+    "audio": 5.0,
+    "lyrics": 10.0,
+}
+
+
+class TokenBucket:
+    """自适应令牌桶: 成功时线性提速, 失败时按比例降速, 被限流时额外暂停一段时间"""
+
+    def __init__(self, rate: float, burst=1.0, min_rate=0.2, max_rate: float | None = None, cooldown=5.0):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate * 4
+        self.cooldown = self._base_cooldown = cooldown
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1.0):
+        """预订令牌, 返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            return max(0.0, -self._tokens / self.rate, self._paused_until - now)
+
+    def wait(self):
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    async def wait_async(self):
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+        return delay
+
+    def success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.min_rate)
+            self.cooldown = self._base_cooldown
+
+    def failure(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * 0.75)
+
+    def throttled(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * 0.5)
+            self._paused_until = time.monotonic() + self.cooldown
+            self.cooldown = min(self.cooldown * 2, 300.0)
+
+    def fix(self, rate: float):
+        """固定速率, 不再自适应"""
+        with self._lock:
+            self.rate = self.min_rate = self.max_rate = rate
+
+
+class RateLimiter:
+    """按接口类别分配独立令牌桶的限流器, 可在线程与 asyncio 任务间共享"""
+
+    def __init__(self, rates: dict[str, float] | None = None, default_rate=5.0):
+        self.rates = {**DEFAULT_RATES, **(rates or {})}
+        self.default_rate = default_rate
+        self.buckets: dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+        self._interval: float | None = None
+
+    def bucket(self, kind: str):
+        with self._lock:
+            bucket = self.buckets.get(kind)
+            if bucket is None:
+                bucket = self.buckets[kind] = TokenBucket(self.rates.get(kind, self.default_rate))
+                if self._interval:
+                    bucket.fix(1 / self._interval)
+            return bucket
+
+    def set_interval(self, interval: float):
+        """每类接口两次调用之间至少间隔 interval 秒"""
+        self._interval = interval
+        for bucket in list(self.buckets.values()):
+            bucket.fix(1 / interval)
+
+    def wait(self, kind: str):
+        return self.bucket(kind).wait()
+
+    async def wait_async(self, kind: str):
+        return await self.bucket(kind).wait_async()
+
+    def report(self, kind: str, code: int | None):
+        bucket = self.bucket(kind)
+        if code == 200:
+            bucket.success()
+        elif code in THROTTLE_CODES:
+            bucket.throttled()
+        else:
+            bucket.failure()
+
+
+class Bandwidth:
+    """下载带宽预算 (字节/秒): 全局一个令牌桶, 另可按主机限速; 指定 hours 时只在该时段内 (本地时间) 限速
+
+    主机名与规则相同或以 "." + 规则结尾时适用该规则, 例如 music.126.net 适用于 m701.music.126.net.
+    """
+
+    def __init__(
+        self,
+        rate: float | None = None,
+        host_rates: dict[str, float] | None = None,
+        hours: tuple[int, int] | None = None,
+    ):
+        self.rate = rate
+        self.host_rates = host_rates or {}
+        self.hours = hours
+        self._global = self._bucket(rate) if rate else None
+        self._hosts = {host: self._bucket(host_rate) for host, host_rate in self.host_rates.items()}
+
+    @staticmethod
+    def _bucket(rate: float):
+        """最多积攒一秒的额度"""
+        bucket = TokenBucket(rate, burst=rate)
+        bucket.fix(rate)
+        return bucket
+
+    def __bool__(self):
+        return bool(self._global or self._hosts)
+
+    def active(self, now: dt.datetime | None = None):
+        if self.hours is None:
+            return True
+        start, end = self.hours
+        hour = (now or dt.datetime.now()).hour
+        return start <= hour < end if start <= end else hour >= start or hour < end
+
+    def reserve(self, host: str, size: int):
+        """预订 size 字节的额度, 返回需要等待的秒数"""
+        if not self.active():
+            return 0.0
+        buckets = [self._global] if self._global else []
+        buckets += [b for rule, b in self._hosts.items() if host == rule or host.endswith("." + rule)]
+        return max((bucket.reserve(size) for bucket in buckets), default=0.0)
+
+    def wait(self, host: str, size: int):
+        delay = self.reserve(host, size)
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    async def wait_async(self, host: str, size: int):
+        delay = self.reserve(host, size)
+        if delay:
+            await asyncio.sleep(delay)
+        return delay
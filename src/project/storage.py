@@ -0,0 +1,384 @@
+import json
+import sqlite3
+from collections.abc import Iterator, MutableMapping
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS musics (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    artists TEXT,
+    album TEXT,
+    pic_url TEXT,
+    publish_time INTEGER,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS playlists (id INTEGER PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS playlist_settings (id INTEGER PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS playlist_tracks (
+    playlist_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    music_id INTEGER NOT NULL,
+    PRIMARY KEY (playlist_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS playlist_tracks_music_id ON playlist_tracks (music_id);
+CREATE TABLE IF NOT EXISTS music_names (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    std_name TEXT NOT NULL,
+    norm TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS music_names_name ON music_names (name);
+CREATE INDEX IF NOT EXISTS music_names_std_name ON music_names (std_name);
+CREATE TABLE IF NOT EXISTS music_trigrams (
+    trigram TEXT NOT NULL,
+    music_id INTEGER NOT NULL,
+    PRIMARY KEY (trigram, music_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS music_trigrams_music_id ON music_trigrams (music_id);
+CREATE TABLE IF NOT EXISTS playlist_names (id INTEGER PRIMARY KEY, name TEXT NOT NULL, norm TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS playlist_names_name ON playlist_names (name);
+"""
+
+
+MUSIC_COLUMNS = {"name": "TEXT", "artists": "TEXT", "album": "TEXT", "pic_url": "TEXT", "publish_time": "INTEGER"}
+"""在旧版数据库上补齐的歌曲列"""
+
+
+def normalize(text: str):
+    return " ".join(text.lower().split())
+
+
+def trigrams(text: str):
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def _placeholders(values):
+    return ", ".join("?" * len(values))
+
+
+def connect(path: Path):
+    conn = sqlite3.connect(path, timeout=60.0, check_same_thread=False)
+    # WAL 需要本地文件系统, 数据目录不能放在网络文件系统上供多台主机共享
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(musics)")}
+    for column, kind in MUSIC_COLUMNS.items():
+        if columns and column not in columns:
+            conn.execute(f"ALTER TABLE musics ADD COLUMN {column} {kind}")
+    conn.executescript(SCHEMA)
+    conn.commit()
+    return conn
+
+
+class Table(MutableMapping[str, Any]):
+    """SQLite 表的字典视图: 按需加载记录, 保存时只写回修改过的记录"""
+
+    def __init__(self, get_conn, name: str, cls: type):
+        self._get_conn = get_conn
+        self.name = name
+        self.cls = cls
+        self._cache: dict[str, Any] = {}
+        self._dirty: set[str] = set()
+        self._deleted: set[str] = set()
+        self._loaded = False
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        return self._get_conn()
+
+    @property
+    def dirty(self):
+        return bool(self._dirty or self._deleted)
+
+    columns: tuple[str, ...] = ("data",)
+
+    def _decode(self, key: str, row: tuple):
+        return self.cls(**json.loads(row[0]))
+
+    def _encode(self, obj) -> tuple:
+        return (json.dumps(asdict(obj), ensure_ascii=False),)
+
+    @property
+    def _select(self):
+        return ", ".join(self.columns)
+
+    def _write(self, conn: sqlite3.Connection, items: list[tuple[str, Any]]):
+        conn.executemany(
+            f"INSERT OR REPLACE INTO {self.name} (id, {self._select}) VALUES (?{', ?' * len(self.columns)})",
+            [(int(k), *self._encode(v)) for k, v in items],
+        )
+
+    def _delete(self, conn: sqlite3.Connection, keys: list[str]):
+        conn.executemany(f"DELETE FROM {self.name} WHERE id = ?", [(int(k),) for k in keys])
+
+    def _load_all(self):
+        if self._loaded:
+            return
+        for row_id, *row in self.conn.execute(f"SELECT id, {self._select} FROM {self.name}"):
+            key = str(row_id)
+            if key not in self._cache and key not in self._deleted:
+                self._cache[key] = self._decode(key, tuple(row))
+        self._loaded = True
+
+    def __getitem__(self, key: str):
+        if key in self._cache:
+            return self._cache[key]
+        if key in self._deleted or self._loaded or not key.isdigit():
+            raise KeyError(key)
+        row = self.conn.execute(f"SELECT {self._select} FROM {self.name} WHERE id = ?", (int(key),)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        value = self._cache[key] = self._decode(key, row)
+        return value
+
+    def __setitem__(self, key: str, value):
+        key = str(key)
+        self._cache[key] = value
+        self._dirty.add(key)
+        self._deleted.discard(key)
+
+    def __delitem__(self, key: str):
+        self[key]
+        del self._cache[key]
+        self._dirty.discard(key)
+        self._deleted.add(key)
+
+    def __contains__(self, key):
+        try:
+            self[str(key)]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self) -> Iterator[str]:
+        self._load_all()
+        return iter(list(self._cache))
+
+    def __len__(self):
+        self._load_all()
+        return len(self._cache)
+
+    def items(self):
+        self._load_all()
+        return self._cache.items()
+
+    def values(self):
+        self._load_all()
+        return self._cache.values()
+
+    def _pending(self):
+        """尚未写入数据库的修改, 查询索引时需要与数据库结果合并"""
+        return {k: self._cache[k] for k in self._dirty}, self._dirty | self._deleted
+
+    def _count_stale(self, index: str):
+        conn = self.conn
+        (rows,) = conn.execute(f"SELECT COUNT(*) FROM {self.name}").fetchone()
+        (indexed,) = conn.execute(f"SELECT COUNT(*) FROM {index}").fetchone()
+        return rows != indexed
+
+    def release(self):
+        """丢弃已保存记录的缓存, 控制长时间任务的内存占用"""
+        self._cache = {k: self._cache[k] for k in self._dirty}
+        self._loaded = False
+
+    def discard(self):
+        """丢弃未保存的修改与全部缓存, 之后的读取重新从数据库加载"""
+        self._cache = {}
+        self._dirty.clear()
+        self._deleted.clear()
+        self._loaded = False
+
+    def flush(self, conn: sqlite3.Connection):
+        if self._dirty:
+            self._write(conn, [(k, self._cache[k]) for k in self._dirty])
+        if self._deleted:
+            self._delete(conn, list(self._deleted))
+        self._dirty.clear()
+        self._deleted.clear()
+
+
+class PlaylistTable(Table):
+    """歌单表, 曲目存放在带索引的 playlist_tracks 关联表中"""
+
+    def _decode(self, key: str, row: tuple, music_ids: list[int] | None = None):
+        if music_ids is None:
+            music_ids = [
+                row[0]
+                for row in self.conn.execute(
+                    "SELECT music_id FROM playlist_tracks WHERE playlist_id = ? ORDER BY position", (int(key),)
+                )
+            ]
+        return self.cls(**json.loads(row[0]), music_ids=music_ids)
+
+    def _encode(self, obj) -> tuple:
+        data = asdict(obj)
+        data.pop("music_ids")
+        return (json.dumps(data, ensure_ascii=False),)
+
+    def _write(self, conn: sqlite3.Connection, items: list[tuple[str, Any]]):
+        super()._write(conn, items)
+        self._delete_tracks(conn, [k for k, _ in items])
+        conn.executemany(
+            "INSERT INTO playlist_tracks (playlist_id, position, music_id) VALUES (?, ?, ?)",
+            [(int(k), i, music_id) for k, v in items for i, music_id in enumerate(v.music_ids)],
+        )
+        self._write_names(conn, items)
+
+    def _delete(self, conn: sqlite3.Connection, keys: list[str]):
+        super()._delete(conn, keys)
+        self._delete_tracks(conn, keys)
+        conn.executemany("DELETE FROM playlist_names WHERE id = ?", [(int(k),) for k in keys])
+
+    def _write_names(self, conn: sqlite3.Connection, items: list[tuple[str, Any]]):
+        conn.executemany(
+            "INSERT OR REPLACE INTO playlist_names (id, name, norm) VALUES (?, ?, ?)",
+            [(int(k), v.name, normalize(v.name)) for k, v in items],
+        )
+
+    def ensure_index(self):
+        """旧数据库首次查询时补建名称索引"""
+        if not self._count_stale("playlist_names"):
+            return
+        conn = self.conn
+        with conn:
+            conn.execute("DELETE FROM playlist_names")
+            rows = conn.execute(f"SELECT id, data FROM {self.name}").fetchall()
+            self._write_names(conn, [(str(i), self.cls(**json.loads(data))) for i, data in rows])
+
+    def search(self, name: str, fuzzy=False):
+        """按名称查询歌单, 返回 (歌单 id, 歌单名)"""
+        self.ensure_index()
+        pending, changed = self._pending()
+        if fuzzy:
+            query = normalize(name)
+            rows = self.conn.execute("SELECT id, name FROM playlist_names WHERE instr(norm, ?) > 0", (query,))
+            matched = [(k, v.name) for k, v in pending.items() if query in normalize(v.name)]
+        else:
+            rows = self.conn.execute("SELECT id, name FROM playlist_names WHERE name = ?", (name,))
+            matched = [(k, v.name) for k, v in pending.items() if v.name == name]
+        yield from ((i, n) for i, n in rows if str(i) not in changed)
+        yield from ((int(k), n) for k, n in matched)
+
+    def playlists_of(self, music_ids):
+        """通过反向索引查询包含指定歌曲的歌单, 返回 (歌单 id, 歌曲 id)"""
+        music_ids = list(music_ids)
+        pending, changed = self._pending()
+        for start in range(0, len(music_ids), 500):
+            chunk = music_ids[start : start + 500]
+            for playlist_id, music_id in self.conn.execute(
+                "SELECT DISTINCT playlist_id, music_id FROM playlist_tracks"
+                f" WHERE music_id IN ({_placeholders(chunk)}) ORDER BY playlist_id",
+                chunk,
+            ):
+                if str(playlist_id) not in changed:
+                    yield playlist_id, music_id
+        music_ids = set(music_ids)
+        for key, playlist in pending.items():
+            yield from ((int(key), i) for i in music_ids.intersection(playlist.music_ids))
+
+    @staticmethod
+    def _delete_tracks(conn: sqlite3.Connection, keys: list[str]):
+        conn.executemany("DELETE FROM playlist_tracks WHERE playlist_id = ?", [(int(k),) for k in keys])
+
+    def _load_all(self):
+        if self._loaded:
+            return
+        tracks: dict[int, list[int]] = {}
+        for playlist_id, music_id in self.conn.execute(
+            "SELECT playlist_id, music_id FROM playlist_tracks ORDER BY playlist_id, position"
+        ):
+            tracks.setdefault(playlist_id, []).append(music_id)
+        for row_id, data in self.conn.execute(f"SELECT id, data FROM {self.name}"):
+            key = str(row_id)
+            if key not in self._cache and key not in self._deleted:
+                self._cache[key] = self._decode(key, (data,), tracks.get(row_id, []))
+        self._loaded = True
+
+
+class MusicTable(Table):
+    """歌曲表, 常用字段单独成列, 同时维护歌名索引与用于模糊查询的三元组索引"""
+
+    columns = ("name", "artists", "album", "pic_url", "publish_time", "data")
+
+    def _decode(self, key: str, row: tuple):
+        if row[0] is None:
+            return self.cls(**json.loads(row[-1]))
+        return self.cls.from_row(int(key), *row)
+
+    def upgrade(self, conn: sqlite3.Connection):
+        """将旧版只有完整 JSON 的记录拆分为各列"""
+        if conn.execute(f"SELECT 1 FROM {self.name} WHERE name IS NULL LIMIT 1").fetchone() is None:
+            return
+        with conn:
+            rows = conn.execute(f"SELECT id, data FROM {self.name} WHERE name IS NULL").fetchall()
+            for start in range(0, len(rows), 1000):
+                chunk = rows[start : start + 1000]
+                Table._write(self, conn, [(str(i), self.cls(**json.loads(data))) for i, data in chunk])
+
+    def _encode(self, obj) -> tuple:
+        return obj.to_row()
+
+    def _write(self, conn: sqlite3.Connection, items: list[tuple[str, Any]]):
+        super()._write(conn, items)
+        self._write_index(conn, items)
+
+    def _delete(self, conn: sqlite3.Connection, keys: list[str]):
+        super()._delete(conn, keys)
+        conn.executemany("DELETE FROM music_names WHERE id = ?", [(int(k),) for k in keys])
+        conn.executemany("DELETE FROM music_trigrams WHERE music_id = ?", [(int(k),) for k in keys])
+
+    @staticmethod
+    def _write_index(conn: sqlite3.Connection, items: list[tuple[str, Any]]):
+        names = [(int(k), v.name, v.get_std_name()) for k, v in items]
+        conn.executemany("DELETE FROM music_trigrams WHERE music_id = ?", [(i,) for i, _, _ in names])
+        conn.executemany(
+            "INSERT OR REPLACE INTO music_names (id, name, std_name, norm) VALUES (?, ?, ?, ?)",
+            [(i, name, std_name, normalize(std_name)) for i, name, std_name in names],
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO music_trigrams (trigram, music_id) VALUES (?, ?)",
+            [(t, i) for i, _, std_name in names for t in trigrams(normalize(std_name))],
+        )
+
+    def ensure_index(self):
+        """旧数据库首次查询时补建索引"""
+        if not self._count_stale("music_names"):
+            return
+        conn = self.conn
+        with conn:
+            conn.execute("DELETE FROM music_names")
+            conn.execute("DELETE FROM music_trigrams")
+            cursor = conn.execute(f"SELECT id, {self._select} FROM {self.name}")
+            while rows := cursor.fetchmany(1000):
+                self._write_index(conn, [(str(i), self._decode(str(i), tuple(row))) for i, *row in rows])
+
+    def search(self, name: str, fuzzy=False):
+        """按名称查询歌曲, 返回 (歌曲 id, 标准名)"""
+        self.ensure_index()
+        pending, changed = self._pending()
+        if fuzzy:
+            query = normalize(name)
+            grams = sorted(trigrams(query))
+            if grams:
+                rows = self.conn.execute(
+                    "SELECT id, std_name FROM music_names WHERE id IN ("
+                    f"SELECT music_id FROM music_trigrams WHERE trigram IN ({_placeholders(grams)})"
+                    " GROUP BY music_id HAVING COUNT(*) = ?) AND instr(norm, ?) > 0",
+                    (*grams, len(grams), query),
+                )
+            else:
+                rows = self.conn.execute("SELECT id, std_name FROM music_names WHERE instr(norm, ?) > 0", (query,))
+            matched = [(k, v.get_std_name()) for k, v in pending.items() if query in normalize(v.get_std_name())]
+        else:
+            rows = self.conn.execute(
+                "SELECT id, std_name FROM music_names WHERE name = ? UNION SELECT id, std_name FROM music_names"
+                " WHERE std_name = ?",
+                (name, name),
+            )
+            matched = [(k, v.get_std_name()) for k, v in pending.items() if name in (v.name, v.get_std_name())]
+        yield from ((i, n) for i, n in rows if str(i) not in changed)
+        yield from ((int(k), n) for k, n in matched)
@@ -0,0 +1,74 @@
+import os
+import shutil
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from pathlib import Path
+
+
+@dataclass
+class Garbage:
+    path: Path
+    size: int
+
+
+@dataclass
+class Sweep:
+    """标记-清除: 先扫描所有目录收集不再被引用的文件, 再统一删除"""
+
+    grace: float = 0.0
+    """修改时间在 grace 秒内的文件视为仍在使用"""
+    groups: dict[str, list[Garbage]] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self._deadline = time.time() - self.grace
+
+    def scan(self, root: Path, is_live: Callable[[os.DirEntry], bool], label: str | None = None):
+        """一次 scandir 遍历目录, is_live 返回 False 且超过宽限期的条目记为垃圾"""
+        group = self.groups.setdefault(label or root.name, [])
+        if not root.is_dir():
+            return group
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if is_live(entry):
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_mtime > self._deadline:
+                    continue
+                size = tree_size(Path(entry.path)) if entry.is_dir(follow_symlinks=False) else stat.st_size
+                group.append(Garbage(Path(entry.path), size))
+        return group
+
+    @property
+    def total(self):
+        return sum(g.size for group in self.groups.values() for g in group)
+
+    def report(self):
+        for label, group in self.groups.items():
+            print(f"{label:<12} {len(group):>8} files {format_size(sum(g.size for g in group)):>10}")
+        print(f"{'total':<12} {sum(map(len, self.groups.values())):>8} files {format_size(self.total):>10}")
+
+    def remove(self):
+        for group in self.groups.values():
+            for garbage in group:
+                if garbage.path.is_dir() and not garbage.path.is_symlink():
+                    shutil.rmtree(garbage.path, ignore_errors=True)
+                else:
+                    garbage.path.unlink(missing_ok=True)
+
+
+def tree_size(root: Path):
+    return sum(fp.stat().st_size for fp in root.rglob("*") if fp.is_file())
+
+
+def format_size(size: float):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}" if unit != "B" else f"{int(size)} B"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+def stem(entry: os.DirEntry):
+    """<id>.mp3, <id>.mp3.part 等文件名中的 id 部分"""
+    return entry.name.split(".", 1)[0]
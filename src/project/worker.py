@@ -0,0 +1,108 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+import warnings
+
+from . import lib
+from .jobs import Job, Unit
+from .storage import connect
+
+JOB_NAME = "crawl"
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Heartbeat:
+    """在后台线程中定期续租, 使用独立的数据库连接, 不干扰正在执行的单元"""
+
+    def __init__(self, unit: Unit, owner: str, ttl: float):
+        self.unit = unit
+        self.owner = owner
+        self.ttl = ttl
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="heartbeat", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        conn: sqlite3.Connection | None = None
+        try:
+            while not self._stop.wait(self.ttl / 3):
+                conn = conn or connect(lib.db.path)
+                if not lib.db.jobs.renew(self.unit, self.owner, self.ttl, conn):
+                    self.lost = True
+                    warnings.warn(f"Lost lease of {self.unit.kind} unit {self.unit.seq}")
+                    return
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+def coordinate(user_ids: list[int], playlist_ids: list[int], options: dict):
+    """创建分布式任务: 每个用户与歌单一个单元, 工作进程处理时继续拆分出详情与下载单元"""
+    job = lib.db.jobs.create(JOB_NAME, options)
+    for user_id in user_ids:
+        lib.db.jobs.add(job, "user", user_id)
+    for playlist_id in playlist_ids:
+        lib.db.jobs.add(job, "playlist", playlist_id)
+    lib.db.checkpoint()
+    return job
+
+
+def work(crawler: "lib.Crawler", job: Job | None = None, ttl=600.0, poll=5.0, exit_when_idle=True):
+    """租用并执行单元直到没有可做的工作; 结果只写回本进程修改过的记录, 同一主机上的多个进程可同时运行
+
+    数据库使用 WAL 模式, 依赖本地文件系统的共享内存, 不能通过网络文件系统在多台主机间共享.
+    """
+    owner = worker_id()
+    jobs: dict[int, Job] = {}
+    count = 0
+    lib.db.deferred = True
+    while True:
+        unit = lib.db.jobs.lease(owner, ttl, job, JOB_NAME)
+        if unit is None:
+            if not finish_idle(job) and exit_when_idle:
+                break
+            time.sleep(poll)
+            continue
+        if unit.job_id not in jobs:
+            jobs[unit.job_id] = lib.db.jobs.get(unit.job_id)
+        unit_job = jobs[unit.job_id]
+        print(f"[{owner}] {unit.kind} unit {unit.job_id}/{unit.seq}")
+        with Heartbeat(unit, owner, ttl) as heartbeat:
+            try:
+                error = crawler.run_unit(unit_job, unit)
+            except Exception as e:
+                warnings.warn(f"Failed to run {unit.kind} unit {unit.seq}: {e}")
+                error = repr(e)
+        if heartbeat.lost or not lib.db.jobs.done(unit, error, owner):
+            warnings.warn(f"[{owner}] Lease of {unit.kind} unit {unit.seq} was lost, discarding its result")
+            lib.db.discard()
+            continue
+        lib.db.checkpoint(release=True)
+        count += 1
+    lib.db.deferred = False
+    print(f"[{owner}] Done: {count} units.")
+    return count
+
+
+def finish_idle(job: Job | None):
+    """结束没有待处理与正在处理单元的任务, 返回其他进程是否仍有单元在处理 (可能还会拆分出新单元)"""
+    busy = False
+    for current in [job] if job is not None else lib.db.jobs.unfinished_jobs(JOB_NAME):
+        if lib.db.jobs.active(current):
+            busy = True
+        elif not lib.db.jobs.progress(current).get("failed"):
+            lib.db.jobs.finish(current)
+    return busy